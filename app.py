@@ -1,8 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, abort
+from werkzeug.security import safe_join
+import click
 import csv
+import gzip
+import hashlib
+import io
+import itertools
 import os
+from collections import OrderedDict
 from datetime import datetime
+from functools import wraps
 import logging
+import mimetypes
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Logging für Debugging aktivieren
 logging.basicConfig(level=logging.INFO)
@@ -10,6 +22,11 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Hinter einem Reverse-Proxy (Render/Heroku) die echte Client-IP aus X-Forwarded-For übernehmen
+if os.environ.get('TRUST_PROXY', '0') == '1':
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+
 # Sicherheit: Secret Key und Admin-Passwort aus Umgebungsvariablen
 try:
     app.secret_key = os.environ.get('SECRET_KEY', 'dev-key-nur-fuer-lokale-entwicklung')
@@ -24,6 +41,9 @@ except Exception as e:
     app.secret_key = 'fallback-key-for-emergency'
     ADMIN_PASSWORD = 'adminpass'
 
+# Maximale Upload-Größe (Plan-Import als CSV/XLSX)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 5)) * 1024 * 1024
+
 # Sicherstellen, dass das data-Verzeichnis existiert
 if not os.path.exists('data'):
     os.makedirs('data')
@@ -59,74 +79,211 @@ def _default_state():
             ['03.08.2024', '', ''],
             ['10.08.2024', '', ''],
         ],
-        'queues': [['ID', 'Name']],
-        'enrollments': [['Person', 'QueueID', 'Timestamp']],
+        'queues': [['ID', 'Name', 'Kapazität']],
+        'enrollments': [['Person', 'QueueID', 'Timestamp', 'Warteliste']],
     }
 
 
-def load_gist_state():
+# Gist-Zeilen: queues [ID, Name, Kapazität], enrollments [Person, QueueID, Timestamp, Warteliste('W')];
+# ältere Gists ohne die letzte Spalte gelten als unbegrenzt bzw. nicht auf der Warteliste
+def _gist_capacity(queues, qid):
+    for row in queues[1:]:
+        if row and row[0] == str(qid):
+            return int(row[2]) if len(row) > 2 and str(row[2]).isdigit() else None
+    return None
+
+
+def _gist_waitlisted(row):
+    return len(row) > 3 and row[3] == 'W'
+
+
+def _gist_enroll_views(state):
+    enroll_by_queue, waitlist_by_queue = {}, {}
+    for row in state.get('enrollments', _default_state()['enrollments'])[1:]:
+        if len(row) >= 2:
+            target = waitlist_by_queue if _gist_waitlisted(row) else enroll_by_queue
+            target.setdefault(str(row[1]), []).append(row[0])
+    return enroll_by_queue, waitlist_by_queue
+
+
+def _gist_promote(state, qid):
+    # Freie Plätze in Reihenfolge der Warteliste auffüllen
+    capacity = _gist_capacity(state.get('queues', []), qid)
+    rows = [r for r in state.get('enrollments', [])[1:] if len(r) >= 2 and r[1] == str(qid)]
+    active = sum(1 for r in rows if not _gist_waitlisted(r))
+    for r in rows:
+        if _gist_waitlisted(r) and (capacity is None or active < capacity):
+            r[3] = ''
+            active += 1
+
+
+# Netzwerkzugriffe aufs Gist laufen in einem eigenen, begrenzten Thread-Pool: Request-Threads warten
+# höchstens GIST_IO_TIMEOUT Sekunden, reine Lesezugriffe bedienen sich aus dem Cache (stale-while-revalidate)
+GIST_IO_WORKERS = int(os.environ.get('GIST_IO_WORKERS', 4))
+GIST_IO_TIMEOUT = float(os.environ.get('GIST_IO_TIMEOUT', 8))
+GIST_CACHE_TTL = float(os.environ.get('GIST_CACHE_TTL', 30))
+_gist_pool = ThreadPoolExecutor(max_workers=GIST_IO_WORKERS, thread_name_prefix='gist-io')
+# Mehr wartende Aufträge werden nicht angenommen -> Anfragen scheitern schnell statt sich zu stauen
+_gist_slots = threading.BoundedSemaphore(GIST_IO_WORKERS * 4)
+_gist_http = threading.local()
+_gist_lock = threading.Lock()
+# Serialisiert Lesen-Ändern-Schreiben: sonst arbeiten parallele Schreiber auf demselben Abruf
+# und der letzte PATCH überschreibt die anderen Änderungen
+_gist_write_lock = threading.Lock()
+_gist_cache = {'content': None, 'etag': None, 'fetched': 0.0, 'written': 0.0}
+_gist_fetch_future = None
+
+
+def _gist_session():
+    # requests.Session ist nicht threadsicher -> eine Session pro Pool-Thread (Keep-Alive)
+    if not hasattr(_gist_http, 'session'):
+        _gist_http.session = requests.Session()
+        _gist_http.session.headers.update({'Authorization': f'token {GITHUB_TOKEN}', 'Accept': 'application/vnd.github+json'})
+    return _gist_http.session
+
+
+def _gist_submit(fn, *args):
+    if not _gist_slots.acquire(blocking=False):
+        logger.warning('Gist-I/O ausgelastet – Anfrage abgelehnt.')
+        return None
+    future = _gist_pool.submit(fn, *args)
+    future.add_done_callback(lambda _f: _gist_slots.release())
+    return future
+
+
+def _gist_wait(future, what):
+    """Wartet höchstens GIST_IO_TIMEOUT; noch nicht gestartete Aufträge werden abgebrochen."""
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=GIST_IO_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        logger.warning(f'Gist {what}: keine Antwort nach {GIST_IO_TIMEOUT:.0f}s')
+    except Exception as e:
+        logger.warning(f'Fehler bei Gist {what}: {e}')
+    return None
+
+
+def _gist_fetch_worker():
+    """Lädt den Gist-Inhalt (bedingt per ETag) und legt ihn im Cache ab; liefert den Inhalt oder ''."""
+    started = time.monotonic()
+    with _gist_lock:
+        etag = _gist_cache['etag'] if _gist_cache['content'] is not None else None
+    r = _gist_session().get(
+        f'https://api.github.com/gists/{GIST_ID}',
+        headers={'If-None-Match': etag} if etag else {},
+        timeout=(3.05, GIST_IO_TIMEOUT),
+    )
+    if r.status_code == 304:
+        with _gist_lock:
+            _gist_cache['fetched'] = time.monotonic()
+            return _gist_cache['content']
+    if r.status_code != 200:
+        raise RuntimeError(f'GET {r.status_code} {r.text[:200]}')
+    fi = r.json().get('files', {}).get(GIST_FILENAME)
+    if not fi:
+        # Datei noch nicht vorhanden
+        return ''
+    if fi.get('truncated') and fi.get('raw_url'):
+        content = _gist_session().get(fi['raw_url'], timeout=(3.05, GIST_IO_TIMEOUT)).text
+    else:
+        content = fi.get('content', '')
+    with _gist_lock:
+        # Ein inzwischen abgeschlossenes Speichern ist neuer als diese Antwort -> dessen Stand liefern,
+        # sonst schreiben angeschlossene Schreibpfade auf einem veralteten Zustand weiter
+        if started < _gist_cache['written']:
+            return _gist_cache['content']
+        _gist_cache.update(content=content, etag=r.headers.get('ETag'), fetched=time.monotonic())
+    return content
+
+
+def _gist_fetch():
+    """Startet einen Abruf oder schließt sich einem bereits laufenden an (single flight)."""
+    global _gist_fetch_future
+    with _gist_lock:
+        if _gist_fetch_future is None or _gist_fetch_future.done():
+            _gist_fetch_future = _gist_submit(_gist_fetch_worker)
+        return _gist_fetch_future
+
+
+def _parse_gist_state(content):
+    try:
+        state = json.loads(content) if content and content.strip() else _default_state()
+    except Exception:
+        state = _default_state()
+    # Sicherheitsnetz: fehlende Keys ergänzen
+    if 'plan' not in state or not isinstance(state['plan'], list):
+        state['plan'] = _default_state()['plan']
+    if 'queues' not in state or not isinstance(state['queues'], list):
+        state['queues'] = _default_state()['queues']
+    if 'enrollments' not in state or not isinstance(state['enrollments'], list):
+        state['enrollments'] = _default_state()['enrollments']
+    return state
+
+
+def load_gist_state(fresh=True):
+    """Lädt den Gist-Zustand. fresh=False (reine Anzeige) nimmt den Cache und frischt ihn bei Bedarf
+    im Hintergrund auf; Schreibpfade laden frisch, weil sie den Zustand zurückschreiben.
+    Ist das Gist mit fresh=True nicht erreichbar, wird None geliefert: ein alter oder leerer Stand
+    darf nicht zurückgeschrieben werden."""
     if not gist_configured():
         logger.warning('Gist nicht konfiguriert (GIST_ID/GITHUB_TOKEN fehlen).')
         return _default_state()
-    try:
-        r = requests.get(
-            f'https://api.github.com/gists/{GIST_ID}',
-            headers={'Authorization': f'token {GITHUB_TOKEN}', 'Accept': 'application/vnd.github+json'},
-            timeout=10,
-        )
-        if r.status_code != 200:
-            logger.warning(f'Gist GET fehlgeschlagen: {r.status_code} {r.text[:200]}')
-            return _default_state()
-        j = r.json()
-        files = j.get('files', {})
-        fi = files.get(GIST_FILENAME)
-        if not fi:
-            # Datei noch nicht vorhanden -> Default anlegen
-            state = _default_state()
-            save_gist_state(state)
-            return state
-        if fi.get('truncated') and fi.get('raw_url'):
-            rr = requests.get(fi['raw_url'], timeout=10)
-            content = rr.text
-        else:
-            content = fi.get('content', '')
-        try:
-            state = json.loads(content) if content.strip() else _default_state()
-        except Exception:
-            state = _default_state()
-        # Sicherheitsnetz: fehlende Keys ergänzen
-        if 'plan' not in state or not isinstance(state['plan'], list):
-            state['plan'] = _default_state()['plan']
-        if 'queues' not in state or not isinstance(state['queues'], list):
-            state['queues'] = _default_state()['queues']
-        if 'enrollments' not in state or not isinstance(state['enrollments'], list):
-            state['enrollments'] = _default_state()['enrollments']
+    with _gist_lock:
+        cached, age = _gist_cache['content'], time.monotonic() - _gist_cache['fetched']
+    if not fresh and cached is not None:
+        if age > GIST_CACHE_TTL:
+            _gist_fetch()
+        return _parse_gist_state(cached)
+    content = _gist_wait(_gist_fetch(), 'GET')
+    if content is None:
+        # Nicht erreichbar: für die Anzeige reicht der Default, Schreibpfade müssen abbrechen
+        return None if fresh else _default_state()
+    if content == '':
+        # Datei noch nicht vorhanden -> Default anlegen
+        state = _default_state()
+        save_gist_state(state)
         return state
-    except Exception as e:
-        logger.warning(f'Fehler beim Laden aus Gist: {e}')
-        return _default_state()
+    return _parse_gist_state(content)
+
+
+def _gist_save_worker(content):
+    r = _gist_session().patch(
+        f'https://api.github.com/gists/{GIST_ID}',
+        json={'files': {GIST_FILENAME: {'content': content}}},
+        timeout=(3.05, GIST_IO_TIMEOUT),
+    )
+    if r.status_code not in (200, 201):
+        logger.warning(f'Gist PATCH fehlgeschlagen: {r.status_code} {r.text[:200]}')
+        return False
+    with _gist_lock:
+        # ETag verwerfen: der nächste Abruf holt den Stand einmal vollständig
+        now = time.monotonic()
+        _gist_cache.update(content=content, etag=None, fetched=now, written=now)
+    return True
 
 
 def save_gist_state(state: dict):
     if not gist_configured():
         logger.warning('Gist nicht konfiguriert – Speichern übersprungen.')
         return False
-    try:
-        content = json.dumps(state, ensure_ascii=False, indent=2)
-        payload = {'files': {GIST_FILENAME: {'content': content}}}
-        r = requests.patch(
-            f'https://api.github.com/gists/{GIST_ID}',
-            headers={'Authorization': f'token {GITHUB_TOKEN}', 'Accept': 'application/vnd.github+json'},
-            json=payload,
-            timeout=10,
-        )
-        if r.status_code not in (200, 201):
-            logger.warning(f'Gist PATCH fehlgeschlagen: {r.status_code} {r.text[:200]}')
-            return False
-        return True
-    except Exception as e:
-        logger.warning(f'Fehler beim Speichern ins Gist: {e}')
-        return False
+    content = json.dumps(state, ensure_ascii=False, indent=2)
+    return bool(_gist_wait(_gist_submit(_gist_save_worker, content), 'PATCH'))
+
+
+def _canonical_state(state):
+    content = json.dumps(state, ensure_ascii=False, sort_keys=True)
+    return content, hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _store_gist_base(db, state):
+    # Basis für reconcile_gist_into_db(): dieser Gist-Stand gilt als mit der DB abgeglichen
+    content, content_hash = _canonical_state(state)
+    base = db.get(GistSyncBase, 1) or GistSyncBase(id=1)
+    base.content, base.content_hash = content, content_hash
+    base.synced_at = datetime.now().isoformat(timespec='seconds')
+    db.merge(base)
 
 
 def mirror_full_from_db_to_gist():
@@ -140,29 +297,34 @@ def mirror_full_from_db_to_gist():
             for e in db.query(PlanEntry).order_by(PlanEntry.id.asc()).all():
                 plan_rows.append([e.datum or '', e.messdiener_text or '', e.art_uhrzeit or ''])
 
-            queues_rows = [['ID', 'Name']]
+            queues_rows = [['ID', 'Name', 'Kapazität']]
             for q in db.query(Queue).order_by(Queue.id.asc()).all():
-                queues_rows.append([str(q.id), q.name])
+                queues_rows.append([str(q.id), q.name, '' if q.capacity is None else str(q.capacity)])
 
-            enroll_rows = [['Person', 'QueueID', 'Timestamp']]
+            enroll_rows = [['Person', 'QueueID', 'Timestamp', 'Warteliste']]
             for en in db.query(Enrollment).order_by(Enrollment.id.asc()).all():
-                enroll_rows.append([en.person, str(en.queue_id), en.timestamp or ''])
+                enroll_rows.append([en.person, str(en.queue_id), en.timestamp or '', 'W' if en.waitlisted else ''])
 
             state = {'plan': plan_rows, 'queues': queues_rows, 'enrollments': enroll_rows}
             # Überschreibe Gist nur, wenn es noch leer ist (nur Header vorhanden)
-            try:
-                existing = load_gist_state()
-                has_content = (
-                    (isinstance(existing.get('plan'), list) and len(existing.get('plan')) > 1) or
-                    (isinstance(existing.get('queues'), list) and len(existing.get('queues')) > 1) or
-                    (isinstance(existing.get('enrollments'), list) and len(existing.get('enrollments')) > 1)
-                )
-            except Exception:
-                has_content = False
-            if has_content:
-                logger.info('Gist hat bereits Inhalte – Mirror wird nicht überschrieben.')
-            else:
-                save_gist_state(state)
+            with _gist_write_lock:
+                try:
+                    existing = load_gist_state()
+                    if existing is None:
+                        logger.warning('Gist nicht erreichbar – Mirror übersprungen.')
+                        return
+                    has_content = (
+                        (isinstance(existing.get('plan'), list) and len(existing.get('plan')) > 1) or
+                        (isinstance(existing.get('queues'), list) and len(existing.get('queues')) > 1) or
+                        (isinstance(existing.get('enrollments'), list) and len(existing.get('enrollments')) > 1)
+                    )
+                except Exception:
+                    has_content = False
+                if has_content:
+                    logger.info('Gist hat bereits Inhalte – Mirror wird nicht überschrieben.')
+                elif save_gist_state(state):
+                    _store_gist_base(db, state)
+                    db.commit()
         finally:
             db.close()
     except Exception as e:
@@ -170,7 +332,9 @@ def mirror_full_from_db_to_gist():
 
 
 # Datenbank (SQLAlchemy) Setup
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, Boolean, ForeignKey
+from sqlalchemy import false as sa_false
+from sqlalchemy import exc as sa_exc
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -184,217 +348,656 @@ else:
         DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql+psycopg://', 1)
     elif DATABASE_URL.startswith('postgresql://') and '+psycopg' not in DATABASE_URL:
         DATABASE_URL = DATABASE_URL.replace('postgresql://', 'postgresql+psycopg://', 1)
+
+
+# --- Lokales Schreib-Journal (append-only JSONL) ---
+# Jede Änderung wird zuerst ins Journal geschrieben und dann auf die DB angewendet.
+# Ist die DB nicht erreichbar, bleibt der Eintrag offen und wird später nachgetragen.
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+JOURNAL_ENABLED = os.environ.get('WRITE_JOURNAL', '1') != '0'
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', os.path.join('data', 'journal.jsonl'))
+JOURNAL_COMPACT_BYTES = int(os.environ.get('JOURNAL_COMPACT_BYTES', 1024 * 1024))
+JOURNAL_REPLAY_INTERVAL = float(os.environ.get('JOURNAL_REPLAY_INTERVAL', 30))
+JOURNAL_FSYNC_TIMEOUT = 5.0
+
+
+class WriteJournal:
+    """Append-only Journal mit Group-Commit: ein Hintergrund-Thread schreibt alle
+    wartenden Einträge gemeinsam und fsync't einmal pro Batch."""
+
+    def __init__(self, path):
+        self.path = path
+        self._cond = threading.Condition()
+        self._pending = []
+        self._seq = 0
+        self._durable_seq = 0
+        self._error = None
+        self._fh = None
+        self._writer = None
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+
+    def _lock_file(self, fh):
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(self, fh):
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def _is_current(self, fh):
+        try:
+            return os.fstat(fh.fileno()).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _locked_handle(self):
+        # Nach einer Kompaktierung (auch durch einen anderen Prozess) die neue Datei öffnen
+        while True:
+            if self._fh is None or not self._is_current(self._fh):
+                if self._fh is not None:
+                    self._fh.close()
+                self._fh = open(self.path, 'a', encoding='utf-8')
+            self._lock_file(self._fh)
+            if self._is_current(self._fh):
+                return self._fh
+            self._unlock_file(self._fh)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                batch_seq = self._seq
+            try:
+                fh = self._locked_handle()
+                try:
+                    fh.write(''.join(batch))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                finally:
+                    self._unlock_file(fh)
+                error = None
+            except Exception as e:
+                error = e
+            with self._cond:
+                self._durable_seq = batch_seq
+                self._error = error
+                self._cond.notify_all()
+
+    def append(self, op, data):
+        """Schreibt einen Eintrag dauerhaft (wartet auf den nächsten fsync) und liefert ihn zurück."""
+        entry = {'id': uuid.uuid4().hex, 'ts': datetime.now().isoformat(timespec='seconds'), 'op': op, 'data': data}
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._cond:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='write-journal', daemon=True)
+                self._writer.start()
+            self._pending.append(line)
+            self._seq += 1
+            my_seq = self._seq
+            self._cond.notify_all()
+            deadline = time.monotonic() + JOURNAL_FSYNC_TIMEOUT
+            while self._durable_seq < my_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('Journal-fsync hat zu lange gedauert')
+                self._cond.wait(remaining)
+            if self._error is not None:
+                raise self._error
+        with self._inflight_lock:
+            self._inflight.add(entry['id'])
+        return entry
+
+    def done(self, entry):
+        with self._inflight_lock:
+            self._inflight.discard(entry['id'])
+
+    def is_inflight(self, entry_id):
+        with self._inflight_lock:
+            return entry_id in self._inflight
+
+    def read_entries(self):
+        entries = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # Abgeschnittene letzte Zeile nach einem Absturz
+                        logger.warning('Journal: unlesbare Zeile übersprungen.')
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def rewrite(self, keep_predicate):
+        """Schreibt das Journal atomar neu und behält nur Einträge, für die keep_predicate True ist.
+        Liefert die IDs der entfernten Einträge."""
+        with self._cond:  # keine Batches während der Kompaktierung
+            with open(self.path, 'a', encoding='utf-8') as lock_fh:
+                self._lock_file(lock_fh)
+                try:
+                    entries = self.read_entries()
+                    kept = [e for e in entries if keep_predicate(e)]
+                    tmp = self.path + '.tmp'
+                    with open(tmp, 'w', encoding='utf-8') as f:
+                        for e in kept:
+                            f.write(json.dumps(e, ensure_ascii=False) + '\n')
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, self.path)
+                finally:
+                    self._unlock_file(lock_fh)
+        kept_ids = {e['id'] for e in kept}
+        return [e['id'] for e in entries if e['id'] not in kept_ids]
+
+
+write_journal = WriteJournal(JOURNAL_PATH)
+
+
+def journal_write(op, data):
+    """Journal-Eintrag für eine Änderung; None, wenn das Journal aus oder nicht schreibbar ist."""
+    if not JOURNAL_ENABLED:
+        return None
+    try:
+        return write_journal.append(op, data)
+    except Exception as e:
+        logger.error(f"Journal-Schreibfehler ({op}): {e}")
+        return None
+
+
+def journal_done(entry):
+    if entry is not None:
+        write_journal.done(entry)
+
+
+def journal_skip(entry, reason):
+    """Schließt einen Eintrag ab, ohne dass Replay ihn in die DB überträgt: er wurde ins Gist
+    gespiegelt ('gist', kommt per reconcile_gist_into_db in die DB) oder dort abgelehnt ('rejected')."""
+    if entry is None:
+        return
+    try:
+        write_journal.done(write_journal.append('skip', {'entry_id': entry['id'], 'reason': reason}))
+    except Exception as e:
+        logger.error(f"Journal-Schreibfehler (skip): {e}")
+
+
+# Gibt es offene, noch nicht angewendete Einträge? Beim Start unbekannt -> einmal nachtragen
+_journal_backlog = {'pending': JOURNAL_ENABLED, 'generation': 0}
+_journal_backlog_lock = threading.Lock()
+
+
+def journal_mark_pending():
+    with _journal_backlog_lock:
+        _journal_backlog['pending'] = True
+        _journal_backlog['generation'] += 1
+
+
+def journal_catch_up():
+    """Trägt vor einer Live-Änderung ältere offene Einträge nach, damit die Journal-Reihenfolge gilt.
+    False, wenn noch ältere Einträge offen sind (DB nicht erreichbar)."""
+    if not _journal_backlog['pending']:
+        return True
+    return replay_journal() is not None and not _journal_backlog['pending']
+
+
+def journal_mark_applied(db, entry):
+    # Im selben Commit wie die nachgetragene Änderung -> Replay wendet jeden Eintrag genau einmal an
+    if entry is not None:
+        db.add(JournalApplied(entry_id=entry['id'], applied_at=datetime.now().isoformat(timespec='seconds')))
+
+
 # Storage-API, die auf DB oder Gist zugreift, je nach USE_GIST
 
 def storage_get_plan():
     if USE_GIST and gist_configured():
-        state = load_gist_state()
+        state = load_gist_state(fresh=False)
         return state.get('plan', _default_state()['plan'])
     return get_plan_list()
 
 
 def storage_save_plan(plan_rows):
-    if USE_GIST and gist_configured():
-        state = load_gist_state()
-        state['plan'] = plan_rows
-        save_gist_state(state)
-        return
-    save_plan_db(plan_rows)
+    # save_plan_db wählt selbst zwischen DB, Journal und Gist
+    return save_plan_db(plan_rows)
 
 
 def storage_get_queues_and_enrollments():
+    """Liefert (queues, enroll_by_queue, waitlist_by_queue); queues als Header + rows [ID, Name, Kapazität]."""
     if USE_GIST and gist_configured():
-        state = load_gist_state()
+        state = load_gist_state(fresh=False)
         queues = state.get('queues', _default_state()['queues'])
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        # View-Format wie bisher: queues als Header + rows, enroll_by_queue Map
-        enroll_by_queue = {}
-        for row in enrollments[1:]:
-            if len(row) >= 2:
-                enroll_by_queue.setdefault(str(row[1]), []).append(row[0])
-        return queues, enroll_by_queue
+        enroll_by_queue, waitlist_by_queue = _gist_enroll_views(state)
+        return queues, enroll_by_queue, waitlist_by_queue
 
     # DB-Zweig (wie bisher)
     db = SessionLocal()
     try:
         q_list = db.query(Queue).order_by(Queue.id.asc()).all()
         e_list = db.query(Enrollment).order_by(Enrollment.id.asc()).all()
-        queues = [['ID', 'Name']]
+        queues = [['ID', 'Name', 'Kapazität']]
         for q in q_list:
-            queues.append([str(q.id), q.name])
-        enroll_by_queue = {}
+            queues.append([str(q.id), q.name, '' if q.capacity is None else str(q.capacity)])
+        enroll_by_queue, waitlist_by_queue = {}, {}
         for e in e_list:
-            qid = str(e.queue_id)
-            enroll_by_queue.setdefault(qid, []).append(e.person)
-        return queues, enroll_by_queue
+            target = waitlist_by_queue if e.waitlisted else enroll_by_queue
+            target.setdefault(str(e.queue_id), []).append(e.person)
+        return queues, enroll_by_queue, waitlist_by_queue
     except Exception as e:
         logger.error(f"DB-Fehler in storage_get_queues_and_enrollments(): {e}")
         _switch_to_gist("DB-Fehler beim Lesen der Queues/Enrollments")
-        state = load_gist_state()
+        state = load_gist_state(fresh=False)
         queues = state.get('queues', _default_state()['queues'])
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        enroll_by_queue = {}
-        for row in enrollments[1:]:
-            if len(row) >= 2:
-                enroll_by_queue.setdefault(str(row[1]), []).append(row[0])
-        return queues, enroll_by_queue
+        enroll_by_queue, waitlist_by_queue = _gist_enroll_views(state)
+        return queues, enroll_by_queue, waitlist_by_queue
     finally:
         db.close()
 
 
-def storage_enroll_person(name, qid):
-    if USE_GIST and gist_configured():
-        state = load_gist_state()
-        queues = state.get('queues', _default_state()['queues'])
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        # Queue existiert?
-        valid = any(row and row[0] == str(qid) for row in queues[1:])
-        if not valid:
-            return False, 'Ungültige Warteschlange.'
-        # Limit prüfen: max 2 unterschiedliche Queues
-        unique_queues = {row[1] for row in enrollments[1:] if row and row[0].strip().lower() == name.strip().lower()}
-        if len(unique_queues) >= 2:
-            return False, 'Maximal 2 Warteschlangen pro Person erlaubt.'
-        # Duplikat in derselben Queue?
-        for row in enrollments[1:]:
-            if row and row[0].strip() == name and row[1] == str(qid):
-                return False, 'Du bist bereits in dieser Warteschlange eingetragen.'
-        # Eintragen
-        ts = datetime.now().isoformat(timespec='minutes')
-        enrollments.append([name, str(qid), ts])
-        state['enrollments'] = enrollments
-        save_gist_state(state)
-        return True, 'Erfolgreich eingetragen!'
+def _lock_queue(db, qid, person=None):
+    """Sperrt die Queue-Zeile (und auf PostgreSQL die Person) bis zum Commit. Auf SQLite
+    sorgt bereits BEGIN IMMEDIATE der WriteSession für die Serialisierung."""
+    if person is not None and db.get_bind().dialect.name == 'postgresql':
+        # Das 2-Queues-Limit gilt queue-übergreifend -> zusätzlich pro Person serialisieren
+        db.execute(sql_text('SELECT pg_advisory_xact_lock(hashtext(lower(:person)))'), {'person': person})
+    return db.query(Queue).filter_by(id=int(qid)).with_for_update().one_or_none()
 
-    # DB-Zweig
-    db = SessionLocal()
-    try:
-        q = db.query(Queue).filter_by(id=int(qid)).one_or_none()
-        if not q:
-            return False, 'Ungültige Warteschlange.'
-        from sqlalchemy import func
-        unique_count = db.query(func.count(func.distinct(Enrollment.queue_id))).filter(Enrollment.person.ilike(name)).scalar() or 0
-        exists = db.query(Enrollment).filter_by(person=name, queue_id=q.id).first()
-        if exists:
-            return False, 'Du bist bereits in dieser Warteschlange eingetragen.'
-        if unique_count >= 2:
-            return False, 'Maximal 2 Warteschlangen pro Person erlaubt.'
-        ts = datetime.now().isoformat(timespec='minutes')
-        db.add(Enrollment(person=name, queue_id=q.id, timestamp=ts))
-        db.commit()
-        return True, 'Erfolgreich eingetragen!'
-    except Exception as e:
-        logger.error(f"DB-Fehler in storage_enroll_person(): {e}")
-        _switch_to_gist("DB-Fehler bei Enrollment")
-        ts = datetime.now().isoformat(timespec='minutes')
-        state = load_gist_state()
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        enrollments.append([name, str(qid), ts])
-        state['enrollments'] = enrollments
-        save_gist_state(state)
-        return True, 'Erfolgreich eingetragen!'
-    finally:
-        db.close()
 
+def _waitlist_message(position):
+    return f'Die Warteschlange ist voll – du stehst auf der Warteliste (Platz {position}).'
 
-def storage_admin_add_queue(name):
-    if USE_GIST and gist_configured():
-        state = load_gist_state()
-        queues = state.get('queues', _default_state()['queues'])
-        # neue ID
-        if len(queues) <= 1:
-            new_id = '1'
+
+def _db_enroll(db, name, qid, ts):
+    q = _lock_queue(db, qid, person=name)
+    if not q:
+        return False, 'Ungültige Warteschlange.'
+    from sqlalchemy import func
+    # Beide Seiten in SQL falten: SQLite-lower() kennt nur ASCII, Python-lower() auch Umlaute
+    unique_count = db.query(func.count(func.distinct(Enrollment.queue_id))).filter(func.lower(Enrollment.person) == func.lower(name)).scalar() or 0
+    exists = db.query(Enrollment.id).filter_by(person=name, queue_id=q.id).first()
+    if exists:
+        return False, 'Du bist bereits in dieser Warteschlange eingetragen.'
+    if unique_count >= 2:
+        return False, 'Maximal 2 Warteschlangen pro Person erlaubt.'
+    waitlisted = False
+    if q.capacity is not None:
+        active = db.query(func.count(Enrollment.id)).filter_by(queue_id=q.id, waitlisted=False).scalar() or 0
+        waitlisted = active >= q.capacity
+    db.add(Enrollment(person=name, queue_id=q.id, timestamp=ts, waitlisted=waitlisted))
+    if waitlisted:
+        position = db.query(func.count(Enrollment.id)).filter_by(queue_id=q.id, waitlisted=True).scalar() + 1
+        return True, _waitlist_message(position)
+    return True, 'Erfolgreich eingetragen!'
+
+
+def _db_promote_waitlist(db, q):
+    """Rückt Personen von der Warteliste nach, solange Plätze frei sind (Queue muss gesperrt sein)."""
+    from sqlalchemy import func
+    waiting = db.query(Enrollment).filter_by(queue_id=q.id, waitlisted=True).order_by(Enrollment.id.asc())
+    if q.capacity is not None:
+        active = db.query(func.count(Enrollment.id)).filter_by(queue_id=q.id, waitlisted=False).scalar() or 0
+        free = q.capacity - active
+        if free <= 0:
+            return 0
+        waiting = waiting.limit(free)
+    promoted = waiting.all()
+    for e in promoted:
+        e.waitlisted = False
+    if promoted:
+        logger.info(f"Queue {q.id}: {len(promoted)} Person(en) von der Warteliste nachgerückt")
+    return len(promoted)
+
+
+def _db_remove_enrollment(db, qid, person):
+    q = _lock_queue(db, qid)
+    if not q:
+        return False
+    removed = db.query(Enrollment).filter_by(queue_id=q.id, person=person).delete(synchronize_session=False)
+    db.flush()
+    _db_promote_waitlist(db, q)
+    return removed > 0
+
+
+def _db_set_capacity(db, qid, capacity):
+    q = _lock_queue(db, qid)
+    if not q:
+        return False
+    # Eine kleinere Kapazität verdrängt niemanden; größere oder keine Grenze lässt nachrücken
+    q.capacity = capacity
+    db.flush()
+    _db_promote_waitlist(db, q)
+    return True
+
+
+def _gist_enroll(state, name, qid, ts):
+    queues = state.get('queues', _default_state()['queues'])
+    enrollments = state.get('enrollments', _default_state()['enrollments'])
+    # Queue existiert?
+    valid = any(row and row[0] == str(qid) for row in queues[1:])
+    if not valid:
+        return False, 'Ungültige Warteschlange.'
+    # Limit prüfen: max 2 unterschiedliche Queues
+    unique_queues = {row[1] for row in enrollments[1:] if row and row[0].strip().lower() == name.strip().lower()}
+    if len(unique_queues) >= 2:
+        return False, 'Maximal 2 Warteschlangen pro Person erlaubt.'
+    # Duplikat in derselben Queue?
+    for row in enrollments[1:]:
+        if row and row[0].strip() == name and row[1] == str(qid):
+            return False, 'Du bist bereits in dieser Warteschlange eingetragen.'
+    # Eintragen (über der Kapazität auf die Warteliste)
+    capacity = _gist_capacity(queues, qid)
+    in_queue = [r for r in enrollments[1:] if len(r) >= 2 and r[1] == str(qid)]
+    active = sum(1 for r in in_queue if not _gist_waitlisted(r))
+    waitlisted = capacity is not None and active >= capacity
+    enrollments.append([name, str(qid), ts, 'W' if waitlisted else ''])
+    state['enrollments'] = enrollments
+    if waitlisted:
+        return True, _waitlist_message(sum(1 for r in in_queue if _gist_waitlisted(r)) + 1)
+    return True, 'Erfolgreich eingetragen!'
+
+
+WRITE_FAILED_MSG = 'Fehler beim Speichern – bitte später erneut versuchen.'
+
+
+def _storage_write(op, data, db_apply, gist_mutate, what, reason, changed=bool):
+    """Führt eine Änderung aus und liefert (outcome, result): 'ok' (in DB bzw. Gist geschrieben),
+    'pending' (im Journal angenommen; wird nachgetragen bzw. ins Gist gespiegelt) oder 'failed'.
+    Das Journal wird erst geschrieben, wenn die DB die Änderung nicht annehmen kann."""
+    if not (USE_GIST and gist_configured()) and journal_catch_up():
+        db = WriteSessionLocal()
+        committing = False
+        try:
+            result = db_apply(db)
+            committing = True
+            db.commit()
+            return 'ok', result
+        except Exception as e:
+            db.rollback()
+            logger.error(f"DB-Fehler in {what}: {e}")
+            if committing or not _db_unavailable(e):
+                # Fehler in der Änderung selbst oder Ausgang des Commits unklar -> nicht nachtragen
+                return 'failed', None
+        finally:
+            db.close()
+    # DB nicht erreichbar oder ältere Einträge noch offen -> nicht an ihnen vorbei in die DB schreiben
+    if not USE_GIST:
+        _switch_to_gist(reason)
+    entry = journal_write(op, data)
+    if entry is None:
+        # Ohne Journal bleibt nur das direkte Schreiben ins Gist
+        result = _gist_write(gist_mutate, changed) if gist_configured() else None
+        return ('failed', None) if result is None else ('ok', result)
+    try:
+        if gist_configured():
+            _gist_mirror_enqueue(entry, gist_mutate, changed)
         else:
-            try:
-                new_id = str(max(int(r[0]) for r in queues[1:] if r and r[0].isdigit()) + 1)
-            except Exception:
-                new_id = str(len(queues))
-        queues.append([new_id, name])
-        state['queues'] = queues
-        save_gist_state(state)
-        return True
-    # DB-Zweig
-    db = SessionLocal()
+            journal_mark_pending()
+        return 'pending', None
+    finally:
+        journal_done(entry)
+
+
+def _gist_rmw(mutate, changed):
+    # Aufrufer hält _gist_write_lock
+    state = load_gist_state()
+    if state is None:
+        return None
+    result = mutate(state)
+    if changed(result) and not save_gist_state(state):
+        return None
+    return result
+
+
+def _gist_write(mutate, changed=bool):
+    """Read-modify-write auf dem Gist. mutate(state) ändert den Zustand und liefert das Ergebnis;
+    ist changed(result) falsch, wurde die Änderung abgelehnt und es wird nichts gespeichert.
+    Liefert None, wenn das Gist nicht geschrieben werden konnte. Schreiber laufen nacheinander,
+    jeder auf dem Stand seines Vorgängers."""
+    # Auch das Warten auf den vorherigen Schreiber ist begrenzt -> Anfragen stauen sich nicht
+    if not _gist_write_lock.acquire(timeout=GIST_IO_TIMEOUT):
+        logger.warning('Gist-Schreibzugriff ausgelastet – Anfrage abgelehnt.')
+        return None
     try:
-        db.add(Queue(name=name))
-        db.commit()
-        return True
-    except Exception as e:
-        logger.error(f"DB-Fehler in storage_admin_add_queue(): {e}")
-        _switch_to_gist("DB-Fehler beim Erstellen einer Queue")
-        state = load_gist_state()
-        queues = state.get('queues', _default_state()['queues'])
-        new_id = '1' if len(queues) <= 1 else str(max(int(r[0]) for r in queues[1:] if r and r[0].isdigit()) + 1)
-        queues.append([new_id, name])
-        state['queues'] = queues
-        save_gist_state(state)
-        return True
+        return _gist_rmw(mutate, changed)
     finally:
-        db.close()
+        _gist_write_lock.release()
+
+
+# Mit Journal wartet auch im Gist-Modus kein Request auf GitHub: die Änderung gilt mit dem
+# Journal-Eintrag als angenommen, ein einzelner Thread spiegelt die Einträge in Reihenfolge ins Gist
+_gist_mirror_cond = threading.Condition()
+_gist_mirror_queue = []
+_gist_mirror_ids = set()
+_gist_mirror_thread = None
+
+
+def _gist_mirror_enqueue(entry, mutate, changed):
+    global _gist_mirror_thread
+    with _gist_mirror_cond:
+        if _gist_mirror_thread is None:
+            _gist_mirror_thread = threading.Thread(target=_gist_mirror_loop, name='gist-mirror', daemon=True)
+            _gist_mirror_thread.start()
+        _gist_mirror_ids.add(entry['id'])
+        _gist_mirror_queue.append((entry, mutate, changed))
+        _gist_mirror_cond.notify()
+
+
+def gist_mirror_owns(entry_id):
+    """True, solange ein Eintrag noch auf die Spiegelung wartet (Replay lässt ihn dann liegen)."""
+    with _gist_mirror_cond:
+        return entry_id in _gist_mirror_ids
+
+
+def _gist_mirror_entry(entry, mutate, changed):
+    with _gist_write_lock:
+        # Ist schon ein Eintrag offen geblieben (oder die DB zurück), bleiben auch alle späteren
+        # offen -> das Replay trägt sie in Journal-Reihenfolge in die DB nach
+        if not USE_GIST or _journal_backlog['pending']:
+            journal_mark_pending()
+            return
+        result = _gist_rmw(mutate, changed)
+        if result is None:
+            logger.warning(f"Journal: Eintrag {entry['id']} ({entry['op']}) nicht ins Gist gespiegelt – bleibt offen.")
+            journal_mark_pending()
+        elif not changed(result):
+            logger.warning(f"Journal: Eintrag {entry['id']} ({entry['op']}) im Gist abgelehnt: {result}")
+            journal_skip(entry, 'rejected')
+        else:
+            journal_skip(entry, 'gist')
+            schedule_static_publish()
 
 
-def storage_admin_delete_queue(qid):
-    if USE_GIST and gist_configured():
-        state = load_gist_state()
-        queues = state.get('queues', _default_state()['queues'])
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        queues = [queues[0]] + [r for r in queues[1:] if r and r[0] != str(qid)]
-        enrollments = [enrollments[0]] + [r for r in enrollments[1:] if r and r[1] != str(qid)]
-        state['queues'] = queues
-        state['enrollments'] = enrollments
-        save_gist_state(state)
-        return True
-    db = SessionLocal()
+def _gist_mirror_loop():
+    while True:
+        with _gist_mirror_cond:
+            while not _gist_mirror_queue:
+                _gist_mirror_cond.wait()
+            entry, mutate, changed = _gist_mirror_queue.pop(0)
+        try:
+            _gist_mirror_entry(entry, mutate, changed)
+        except Exception as e:
+            logger.error(f"Journal: Spiegelung von {entry['id']} ins Gist fehlgeschlagen: {e}")
+            journal_mark_pending()
+        finally:
+            with _gist_mirror_cond:
+                _gist_mirror_ids.discard(entry['id'])
+
+
+def storage_enroll_person(name, qid):
     try:
-        db.query(Enrollment).filter(Enrollment.queue_id == int(qid)).delete()
-        db.query(Queue).filter(Queue.id == int(qid)).delete()
-        db.commit()
-        return True
-    except Exception as e:
-        logger.error(f"DB-Fehler in storage_admin_delete_queue(): {e}")
-        _switch_to_gist("DB-Fehler beim Löschen einer Queue")
-        state = load_gist_state()
-        queues = state.get('queues', _default_state()['queues'])
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        queues = [queues[0]] + [r for r in queues[1:] if r and r[0] != str(qid)]
-        enrollments = [enrollments[0]] + [r for r in enrollments[1:] if r and r[1] != str(qid)]
-        state['queues'] = queues
-        state['enrollments'] = enrollments
-        save_gist_state(state)
-        return True
-    finally:
-        db.close()
+        qid = int(qid)
+    except (TypeError, ValueError):
+        return False, 'Ungültige Warteschlange.'
+    ts = datetime.now().isoformat(timespec='minutes')
+    outcome, result = _storage_write('enroll', {'name': name, 'queue_id': str(qid), 'ts': ts},
+                                     lambda db: _db_enroll(db, name, qid, ts),
+                                     lambda state: _gist_enroll(state, name, qid, ts),
+                                     'storage_enroll_person()', 'DB-Fehler bei Enrollment', changed=lambda r: r[0])
+    if outcome == 'pending':
+        result = True, 'Eingetragen – wird übernommen, sobald die Datenbank wieder erreichbar ist.'
+    elif outcome == 'failed':
+        result = False, WRITE_FAILED_MSG
+    ok, msg = result
+    if outcome == 'ok' and ok:
+        schedule_static_publish()
+    return ok, msg
+
+
+def _gist_add_queue(state, name, capacity):
+    queues = state.get('queues', _default_state()['queues'])
+    # neue ID
+    ids = [int(r[0]) for r in queues[1:] if r and str(r[0]).isdigit()]
+    new_id = str(max(ids) + 1) if ids else '1'
+    queues.append([new_id, name, '' if capacity is None else str(capacity)])
+    state['queues'] = queues
+    return True
+
+
+def storage_admin_add_queue(name, capacity=None):
+    outcome, _ = _storage_write('add_queue', {'name': name, 'capacity': capacity},
+                                lambda db: db.add(Queue(name=name, capacity=capacity)),
+                                lambda state: _gist_add_queue(state, name, capacity),
+                                'storage_admin_add_queue()', 'DB-Fehler beim Erstellen einer Queue')
+    # Nur nach einer geschriebenen Änderung; Nachtrag und Spiegelung veröffentlichen selbst
+    if outcome == 'ok':
+        schedule_static_publish()
+    return outcome != 'failed'
+
+
+def _db_delete_queue(db, qid):
+    db.query(Enrollment).filter(Enrollment.queue_id == int(qid)).delete()
+    db.query(Queue).filter(Queue.id == int(qid)).delete()
+
+
+def _gist_delete_queue(state, qid):
+    queues = state.get('queues', _default_state()['queues'])
+    enrollments = state.get('enrollments', _default_state()['enrollments'])
+    state['queues'] = [queues[0]] + [r for r in queues[1:] if r and r[0] != str(qid)]
+    state['enrollments'] = [enrollments[0]] + [r for r in enrollments[1:] if r and r[1] != str(qid)]
+    return True
+
+
+def storage_admin_delete_queue(qid):
+    outcome, _ = _storage_write('delete_queue', {'queue_id': str(qid)},
+                                lambda db: _db_delete_queue(db, qid),
+                                lambda state: _gist_delete_queue(state, qid),
+                                'storage_admin_delete_queue()', 'DB-Fehler beim Löschen einer Queue')
+    if outcome == 'ok':
+        schedule_static_publish()
+    return outcome != 'failed'
+
+
+def _db_clear_enrollments(db, qid):
+    db.query(Enrollment).filter(Enrollment.queue_id == int(qid)).delete()
+
+
+def _gist_clear_enrollments(state, qid):
+    enrollments = state.get('enrollments', _default_state()['enrollments'])
+    state['enrollments'] = [enrollments[0]] + [r for r in enrollments[1:] if r and r[1] != str(qid)]
+    return True
 
 
 def storage_admin_clear_enrollments(qid):
-    if USE_GIST and gist_configured():
-        state = load_gist_state()
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        enrollments = [enrollments[0]] + [r for r in enrollments[1:] if r and r[1] != str(qid)]
-        state['enrollments'] = enrollments
-        save_gist_state(state)
-        return True
-    db = SessionLocal()
-    try:
-        db.query(Enrollment).filter(Enrollment.queue_id == int(qid)).delete()
-        db.commit()
+    outcome, _ = _storage_write('clear_enrollments', {'queue_id': str(qid)},
+                                lambda db: _db_clear_enrollments(db, qid),
+                                lambda state: _gist_clear_enrollments(state, qid),
+                                'storage_admin_clear_enrollments()', 'DB-Fehler beim Leeren einer Queue')
+    if outcome == 'ok':
+        schedule_static_publish()
+    return outcome != 'failed'
+
+
+def _gist_remove_enrollment(state, qid, person):
+    enrollments = state.get('enrollments', _default_state()['enrollments'])
+    kept = [enrollments[0]] + [r for r in enrollments[1:] if r and not (r[0] == person and r[1] == str(qid))]
+    state['enrollments'] = kept
+    _gist_promote(state, qid)
+    return len(kept) < len(enrollments)
+
+
+def storage_admin_remove_enrollment(qid, person):
+    """True: ausgetragen (oder angenommen), False: nicht gefunden, None: Speichern fehlgeschlagen."""
+    outcome, removed = _storage_write('remove_enrollment', {'queue_id': str(qid), 'person': person},
+                                      lambda db: _db_remove_enrollment(db, qid, person),
+                                      lambda state: _gist_remove_enrollment(state, qid, person),
+                                      'storage_admin_remove_enrollment()', 'DB-Fehler beim Austragen einer Person')
+    if outcome == 'ok' and removed:
+        schedule_static_publish()
+    if outcome == 'pending':
         return True
-    except Exception as e:
-        logger.error(f"DB-Fehler in storage_admin_clear_enrollments(): {e}")
-        _switch_to_gist("DB-Fehler beim Leeren einer Queue")
-        state = load_gist_state()
-        enrollments = state.get('enrollments', _default_state()['enrollments'])
-        enrollments = [enrollments[0]] + [r for r in enrollments[1:] if r and r[1] != str(qid)]
-        state['enrollments'] = enrollments
-        save_gist_state(state)
+    return None if outcome == 'failed' else removed
+
+
+def _gist_set_capacity(state, qid, capacity):
+    queues = state.get('queues', _default_state()['queues'])
+    found = False
+    for row in queues[1:]:
+        if row and row[0] == str(qid):
+            del row[2:]
+            row.append('' if capacity is None else str(capacity))
+            found = True
+    state['queues'] = queues
+    if found:
+        _gist_promote(state, qid)
+    return found
+
+
+def storage_admin_set_capacity(qid, capacity):
+    """True: gespeichert (oder angenommen), False: Queue nicht gefunden, None: Speichern fehlgeschlagen."""
+    outcome, found = _storage_write('set_capacity', {'queue_id': str(qid), 'capacity': capacity},
+                                    lambda db: _db_set_capacity(db, qid, capacity),
+                                    lambda state: _gist_set_capacity(state, qid, capacity),
+                                    'storage_admin_set_capacity()', 'DB-Fehler beim Ändern der Kapazität')
+    if outcome == 'ok' and found:
+        schedule_static_publish()
+    if outcome == 'pending':
         return True
-    finally:
-        db.close()
-
+    return None if outcome == 'failed' else found
 
 
 engine = create_engine(DATABASE_URL, future=True)
+
+if engine.dialect.name == 'sqlite':
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def _sqlite_on_connect(dbapi_connection, connection_record):
+        # Transaktionen selbst beginnen (siehe _sqlite_on_begin); WAL lässt Leser neben einem Schreiber zu
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+        dbapi_connection.execute('PRAGMA busy_timeout=15000')
+
+    @event.listens_for(engine, 'begin')
+    def _sqlite_on_begin(conn):
+        # Schreib-Sessions holen sich die Schreibsperre sofort, nicht erst beim ersten INSERT –
+        # sonst könnten zwei parallele Eintragungen dieselben Zählungen lesen
+        conn.exec_driver_sql('BEGIN IMMEDIATE' if conn.get_execution_options().get('sqlite_immediate') else 'BEGIN')
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Für Änderungen: auf SQLite BEGIN IMMEDIATE, auf PostgreSQL zusätzlich Zeilensperren in den _db_*-Helfern
+WriteSessionLocal = sessionmaker(bind=engine.execution_options(sqlite_immediate=True), autoflush=False, autocommit=False)
+
+
+def _db_unavailable(e):
+    """DB nicht erreichbar/gesperrt (später erneut versuchen) – im Gegensatz zu Fehlern in der Änderung selbst."""
+    return (isinstance(e, (sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.TimeoutError))
+            or getattr(e, 'connection_invalidated', False))
 Base = declarative_base()
 
 
@@ -410,21 +1013,120 @@ class Queue(Base):
     __tablename__ = 'queues'
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
+    capacity = Column(Integer, nullable=True)  # None = unbegrenzt
 
 
 class Enrollment(Base):
     __tablename__ = 'enrollments'
     id = Column(Integer, primary_key=True)
     person = Column(String(100), nullable=False)
-    queue_id = Column(Integer, ForeignKey('queues.id', ondelete='CASCADE'), nullable=False)
+    queue_id = Column(Integer, ForeignKey('queues.id', ondelete='CASCADE'), nullable=False, index=True)
     timestamp = Column(String(32), nullable=True)
+    # Über der Kapazität -> Warteliste; Reihenfolge = id
+    waitlisted = Column(Boolean, nullable=False, default=False, server_default=sa_false())
 
     queue = relationship('Queue')
 
 
-def init_db_and_migrate():
+class RateLimitBucket(Base):
+    # Gemeinsamer Token-Bucket-Speicher für mehrere Worker (RATE_LIMIT_STORE=db)
+    __tablename__ = 'rate_limit_buckets'
+    key = Column(String(200), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated = Column(Float, nullable=False)
+
+
+class GistSyncBase(Base):
+    # Gist-Stand beim letzten Abgleich mit der DB (Basis für den Drei-Wege-Vergleich)
+    __tablename__ = 'gist_sync_base'
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    content = Column(Text, nullable=False)
+    synced_at = Column(String(32), nullable=True)
+
+
+class JournalApplied(Base):
+    # IDs der Journal-Einträge, die bereits in der DB angekommen sind
+    __tablename__ = 'journal_applied'
+    entry_id = Column(String(32), primary_key=True)
+    applied_at = Column(String(32), nullable=True)
+
+
+# --- Volltextindex über den Plan (SQLite FTS5 / PostgreSQL tsvector+GIN) ---
+from sqlalchemy import text as sql_text
+
+SEARCH_BACKEND = None  # 'fts5', 'postgres' oder None (Fallback ohne Index)
+
+
+def init_search_index():
+    """Legt den Volltextindex an; Trigger bzw. generierte Spalte halten ihn bei jedem Speichern aktuell."""
+    global SEARCH_BACKEND
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == 'sqlite':
+            exists = conn.execute(sql_text(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='plan_entries_fts'")).first()
+            conn.execute(sql_text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS plan_entries_fts USING fts5("
+                "messdiener_text, art_uhrzeit, content='plan_entries', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"))
+            conn.execute(sql_text(
+                "CREATE TRIGGER IF NOT EXISTS plan_entries_fts_ai AFTER INSERT ON plan_entries BEGIN "
+                "INSERT INTO plan_entries_fts(rowid, messdiener_text, art_uhrzeit) "
+                "VALUES (new.id, new.messdiener_text, new.art_uhrzeit); END"))
+            conn.execute(sql_text(
+                "CREATE TRIGGER IF NOT EXISTS plan_entries_fts_ad AFTER DELETE ON plan_entries BEGIN "
+                "INSERT INTO plan_entries_fts(plan_entries_fts, rowid, messdiener_text, art_uhrzeit) "
+                "VALUES ('delete', old.id, old.messdiener_text, old.art_uhrzeit); END"))
+            conn.execute(sql_text(
+                "CREATE TRIGGER IF NOT EXISTS plan_entries_fts_au AFTER UPDATE ON plan_entries BEGIN "
+                "INSERT INTO plan_entries_fts(plan_entries_fts, rowid, messdiener_text, art_uhrzeit) "
+                "VALUES ('delete', old.id, old.messdiener_text, old.art_uhrzeit); "
+                "INSERT INTO plan_entries_fts(rowid, messdiener_text, art_uhrzeit) "
+                "VALUES (new.id, new.messdiener_text, new.art_uhrzeit); END"))
+            if not exists:
+                # Bestehende Zeilen einmalig indexieren
+                conn.execute(sql_text("INSERT INTO plan_entries_fts(plan_entries_fts) VALUES ('rebuild')"))
+            SEARCH_BACKEND = 'fts5'
+        elif dialect == 'postgresql':
+            conn.execute(sql_text(
+                "ALTER TABLE plan_entries ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(messdiener_text, '') || ' ' || "
+                "coalesce(art_uhrzeit, ''))) STORED"))
+            conn.execute(sql_text(
+                "CREATE INDEX IF NOT EXISTS ix_plan_entries_search ON plan_entries USING GIN (search_vector)"))
+            SEARCH_BACKEND = 'postgres'
+
+
+def migrate_schema():
+    """Ergänzt Spalten und Indizes, die in bestehenden Datenbanken noch fehlen."""
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    queue_cols = {c['name'] for c in inspector.get_columns('queues')}
+    enroll_cols = {c['name'] for c in inspector.get_columns('enrollments')}
+    with engine.begin() as conn:
+        if 'capacity' not in queue_cols:
+            conn.execute(sql_text('ALTER TABLE queues ADD COLUMN capacity INTEGER'))
+        if 'waitlisted' not in enroll_cols:
+            conn.execute(sql_text('ALTER TABLE enrollments ADD COLUMN waitlisted BOOLEAN NOT NULL DEFAULT false'))
+        # Indizes per IF NOT EXISTS statt Reflection: der Ausdrucksindex auf lower(person)
+        # lässt sich unter SQLite nicht reflektieren und erzeugt sonst eine SAWarning
+        conn.execute(sql_text('CREATE INDEX IF NOT EXISTS ix_enrollments_queue_id ON enrollments (queue_id)'))
+        conn.execute(sql_text('CREATE INDEX IF NOT EXISTS ix_enrollments_person_lower ON enrollments (lower(person))'))
+
+
+def ensure_schema():
     # Tabellen anlegen
     Base.metadata.create_all(engine)
+    migrate_schema()
+    try:
+        init_search_index()
+    except Exception as e:
+        logger.warning(f"Volltextindex nicht verfügbar, Suche ohne Index: {e}")
+
+
+def init_db_and_migrate():
+    ensure_schema()
     from sqlalchemy import func
     db = SessionLocal()
     try:
@@ -539,27 +1241,458 @@ def get_plan_list():
         db.close()
 
 
+def _db_save_plan(db, plan_rows):
+    # Alles ersetzen (als ein Bulk-Insert statt einzelner Objekte)
+    db.query(PlanEntry).delete()
+    db.bulk_insert_mappings(PlanEntry, [
+        {
+            'datum': row[0] if len(row) > 0 else '',
+            'messdiener_text': row[1] if len(row) > 1 else '',
+            'art_uhrzeit': row[2] if len(row) > 2 else '',
+        }
+        for row in plan_rows[1:]
+    ])
+
+
+def _gist_set_plan(state, plan_rows):
+    state['plan'] = plan_rows
+    return True
+
+
 def save_plan_db(plan_rows):
+    """Ersetzt den Plan; False, wenn nicht gespeichert werden konnte."""
     # plan_rows: [['Datum','Messdiener','Art/Uhrzeit'], [datum, mess, art], ...]
-    if USE_GIST and gist_configured():
-        storage_save_plan(plan_rows)
-        return
-    db = SessionLocal()
-    try:
-        # Alles ersetzen
-        db.query(PlanEntry).delete()
-        for row in plan_rows[1:]:
-            datum = row[0] if len(row) > 0 else ''
-            mess = row[1] if len(row) > 1 else ''
-            art = row[2] if len(row) > 2 else ''
-            db.add(PlanEntry(datum=datum, messdiener_text=mess, art_uhrzeit=art))
-        db.commit()
-    except Exception as e:
-        logger.error(f"DB-Fehler in save_plan_db(): {e}")
-        _switch_to_gist("DB-Fehler beim Speichern des Plans")
-        storage_save_plan(plan_rows)
-    finally:
-        db.close()
+    outcome, _ = _storage_write('save_plan', {'rows': plan_rows},
+                                lambda db: _db_save_plan(db, plan_rows),
+                                lambda state: _gist_set_plan(state, plan_rows),
+                                'save_plan_db()', 'DB-Fehler beim Speichern des Plans')
+    if outcome == 'ok':
+        schedule_static_publish()
+    return outcome != 'failed'
+
+
+def _apply_row_changes(plan_rows, changes):
+    # changes: {Zeilenindex (1-basiert): [datum, mess, art]}; leere Zeilen werden gelöscht,
+    # Indizes hinter dem Planende werden angehängt
+    plan_rows = [list(r) for r in plan_rows]
+    counts = {'updated': 0, 'inserted': 0, 'deleted': 0}
+    to_delete = set()
+    for idx in sorted(changes):
+        row = changes[idx]
+        if idx < len(plan_rows):
+            if any(row):
+                plan_rows[idx] = row
+                counts['updated'] += 1
+            else:
+                to_delete.add(idx)
+                counts['deleted'] += 1
+        elif any(row):
+            plan_rows.append(row)
+            counts['inserted'] += 1
+    plan_rows = [r for i, r in enumerate(plan_rows) if i not in to_delete]
+    return plan_rows, counts
+
+
+def _db_update_plan_rows(db, changes):
+    entries = db.query(PlanEntry).order_by(PlanEntry.id.asc()).all()
+    counts = {'updated': 0, 'inserted': 0, 'deleted': 0}
+    new_rows = []
+    for idx in sorted(changes):
+        datum, mess, art = changes[idx]
+        if idx <= len(entries):
+            e = entries[idx - 1]
+            if datum or mess or art:
+                e.datum, e.messdiener_text, e.art_uhrzeit = datum, mess, art
+                counts['updated'] += 1
+            else:
+                db.delete(e)
+                counts['deleted'] += 1
+        elif datum or mess or art:
+            new_rows.append({'datum': datum, 'messdiener_text': mess, 'art_uhrzeit': art})
+    if new_rows:
+        db.bulk_insert_mappings(PlanEntry, new_rows)
+        counts['inserted'] = len(new_rows)
+    return counts
+
+
+def _gist_update_plan_rows(state, changes):
+    state['plan'], counts = _apply_row_changes(state.get('plan', _default_state()['plan']), changes)
+    return counts
+
+
+def storage_update_plan_rows(changes):
+    """Übernimmt nur geänderte Planzeilen (Teil-Update statt kompletter Neuschreibung).
+    Liefert die Zählungen oder None, wenn nicht gespeichert werden konnte."""
+    outcome, counts = _storage_write('update_plan_rows', {'changes': {str(k): v for k, v in changes.items()}},
+                                     lambda db: _db_update_plan_rows(db, changes),
+                                     lambda state: _gist_update_plan_rows(state, changes),
+                                     'storage_update_plan_rows()', 'DB-Fehler beim Teil-Update des Plans')
+    if outcome == 'ok' and any(counts.values()):
+        schedule_static_publish()
+    if outcome == 'pending':
+        return {'updated': 0, 'inserted': 0, 'deleted': 0, 'pending': True}
+    return None if outcome == 'failed' else counts
+
+# --- Journal-Replay und Kompaktierung ---
+JOURNAL_APPLIERS = {
+    'save_plan': lambda db, d: _db_save_plan(db, d['rows']),
+    'update_plan_rows': lambda db, d: _db_update_plan_rows(db, {int(k): v for k, v in d['changes'].items()}),
+    'enroll': lambda db, d: _db_enroll(db, d['name'], d['queue_id'], d['ts']),
+    'add_queue': lambda db, d: db.add(Queue(name=d['name'], capacity=d.get('capacity'))),
+    'delete_queue': lambda db, d: _db_delete_queue(db, d['queue_id']),
+    'clear_enrollments': lambda db, d: _db_clear_enrollments(db, d['queue_id']),
+    'remove_enrollment': lambda db, d: _db_remove_enrollment(db, d['queue_id'], d['person']),
+    'set_capacity': lambda db, d: _db_set_capacity(db, d['queue_id'], d['capacity']),
+}
+_replay_lock = threading.Lock()
+
+
+def replay_journal():
+    """Trägt offene Journal-Einträge in Reihenfolge in die DB nach (idempotent).
+    Liefert die Anzahl nachgetragener Einträge oder None, wenn die DB nicht erreichbar ist."""
+    if not JOURNAL_ENABLED:
+        return 0
+    with _replay_lock:
+        with _journal_backlog_lock:
+            generation = _journal_backlog['generation']
+        entries = write_journal.read_entries()
+        db = WriteSessionLocal()
+        try:
+            applied = {row[0] for row in db.query(JournalApplied.entry_id).all()} if entries else set()
+            skipped = {e['data']['entry_id'] for e in entries if e.get('op') == 'skip'}
+            replayed = 0
+
+            def settle(entry_ids):
+                # Marker setzen, soweit nicht schon vorhanden (auch vom Request selbst); ein Commit
+                ids = [i for i in entry_ids if i and i not in applied and db.get(JournalApplied, i) is None]
+                for entry_id in ids:
+                    journal_mark_applied(db, {'id': entry_id})
+                db.commit()
+                applied.update(ids)
+
+            for entry in entries:
+                if entry['id'] in applied:
+                    continue
+                if entry['id'] in skipped:
+                    # Ausgang steht fest (im Gist, abgelehnt oder endgültig fehlgeschlagen) -> nie in die DB,
+                    # auch wenn der Request noch läuft
+                    settle([entry['id']])
+                    continue
+                if entry.get('op') == 'skip':
+                    # Ziel im selben Commit abschließen: sonst könnte die Kompaktierung den Skip entfernen,
+                    # während das Ziel noch offen ist, und ein späteres Replay würde es anwenden
+                    settle([entry['id'], entry.get('data', {}).get('entry_id')])
+                    continue
+                if write_journal.is_inflight(entry['id']) or gist_mirror_owns(entry['id']):
+                    # Request oder Gist-Spiegelung noch nicht fertig; bleibt er offen, wird er als offen gemeldet
+                    continue
+                if db.get(JournalApplied, entry['id']) is not None:
+                    continue  # inzwischen vom Request selbst angewendet
+                applier = JOURNAL_APPLIERS.get(entry.get('op'))
+                try:
+                    if applier is None:
+                        logger.warning(f"Journal: unbekannte Operation {entry.get('op')!r} übersprungen.")
+                    else:
+                        applier(db, entry.get('data', {}))
+                    journal_mark_applied(db, entry)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    if _db_unavailable(e):
+                        raise
+                    # Fehler im Eintrag selbst: würde bei jedem Versuch wieder scheitern -> verwerfen
+                    logger.error(f"Journal: Eintrag {entry['id']} ({entry.get('op')}) verworfen: {e}")
+                    journal_mark_applied(db, entry)
+                    db.commit()
+                replayed += 1
+            with _journal_backlog_lock:
+                if _journal_backlog['generation'] == generation:
+                    _journal_backlog['pending'] = False
+            if replayed:
+                logger.info(f"Journal: {replayed} Einträge in die DB nachgetragen.")
+                schedule_static_publish()
+            return replayed
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Journal-Replay nicht möglich (DB nicht erreichbar?): {e}")
+            return None
+        finally:
+            db.close()
+
+
+def compact_journal(force=False):
+    """Entfernt bereits angewendete Einträge aus dem Journal, sobald es JOURNAL_COMPACT_BYTES überschreitet."""
+    if not JOURNAL_ENABLED or (not force and write_journal.size() < JOURNAL_COMPACT_BYTES):
+        return 0
+    with _replay_lock:
+        db = WriteSessionLocal()
+        try:
+            applied = {row[0] for row in db.query(JournalApplied.entry_id).all()}
+            removed = write_journal.rewrite(lambda e: e['id'] not in applied)
+            # Marker für entfernte Einträge werden nicht mehr gebraucht
+            for i in range(0, len(removed), 500):
+                db.query(JournalApplied).filter(JournalApplied.entry_id.in_(removed[i:i + 500])).delete(synchronize_session=False)
+            db.commit()
+            if removed:
+                logger.info(f"Journal kompaktiert: {len(removed)} Einträge entfernt.")
+            return len(removed)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Journal-Kompaktierung fehlgeschlagen: {e}")
+            return 0
+        finally:
+            db.close()
+
+
+def _journal_maintenance_loop():
+    while True:
+        time.sleep(JOURNAL_REPLAY_INTERVAL)
+        # Im Gist-Modus trägt _gist_reconcile_loop nach – erst nach dem Abgleich, wegen der Reihenfolge
+        if not USE_GIST and replay_journal() is not None:
+            compact_journal()
+
+
+if JOURNAL_ENABLED:
+    # Beim Start offene Einträge aus einer früheren DB-Störung nachtragen
+    if replay_journal() is not None:
+        compact_journal()
+    threading.Thread(target=_journal_maintenance_loop, name='journal-replay', daemon=True).start()
+
+
+# --- Abgleich Gist -> DB nach einer Fallback-Phase ---
+# Drei-Wege-Vergleich über natürliche Schlüssel: Basis (Gist-Stand beim letzten Abgleich),
+# aktueller Gist und DB. Übernommen wird nur, was sich seit der Basis im Gist geändert hat und
+# in der DB noch dem Basis-Stand entspricht; alles andere ist ein Konflikt und bleibt in der DB.
+GIST_RECONCILE_INTERVAL = int(os.environ.get('GIST_RECONCILE_INTERVAL', 120))
+_reconcile_lock = threading.Lock()
+_MISSING = object()
+
+
+def _keyed_plan(rows):
+    # Planzeilen haben keine ID: Datum + Art/Uhrzeit (+ laufende Nummer bei Dubletten)
+    keyed, seen = {}, {}
+    for datum, messdiener, art in rows:
+        n = seen[(datum, art)] = seen.get((datum, art), 0) + 1
+        keyed[(datum, art, n)] = messdiener
+    return keyed
+
+
+def _gist_keyed(state):
+    """Zerlegt einen Gist-Zustand in {Bereich: {natürlicher Schlüssel: Werte}}."""
+    queues = {}
+    for row in state.get('queues', [])[1:]:
+        if row and str(row[0]).isdigit():
+            capacity = int(row[2]) if len(row) > 2 and str(row[2]).isdigit() else None
+            queues[str(row[0])] = (row[1] if len(row) > 1 else '', capacity)
+    enrollments = {}
+    for row in state.get('enrollments', [])[1:]:
+        if len(row) >= 2 and str(row[1]).isdigit():
+            enrollments[(row[0], str(row[1]))] = (row[2] if len(row) > 2 else '', _gist_waitlisted(row))
+    plan = _keyed_plan((list(row) + ['', '', ''])[:3] for row in state.get('plan', [])[1:])
+    return {'queues': queues, 'enrollments': enrollments, 'plan': plan}
+
+
+def _db_keyed(db):
+    """Wie _gist_keyed für die DB, zusätzlich mit den Zeilen-IDs je Schlüssel."""
+    keyed = {'queues': {}, 'enrollments': {}, 'plan': {}}
+    ids = {'queues': {}, 'enrollments': {}, 'plan': {}}
+    for q in db.query(Queue.id, Queue.name, Queue.capacity):
+        keyed['queues'][str(q.id)] = (q.name, q.capacity)
+        ids['queues'][str(q.id)] = q.id
+    for e in db.query(Enrollment.id, Enrollment.person, Enrollment.queue_id, Enrollment.timestamp,
+                      Enrollment.waitlisted).order_by(Enrollment.id.asc()):
+        key = (e.person, str(e.queue_id))
+        if key not in keyed['enrollments']:
+            keyed['enrollments'][key] = (e.timestamp or '', bool(e.waitlisted))
+            ids['enrollments'][key] = e.id
+    plan = db.query(PlanEntry.id, PlanEntry.datum, PlanEntry.messdiener_text, PlanEntry.art_uhrzeit).order_by(PlanEntry.id.asc()).all()
+    keyed['plan'] = _keyed_plan((p.datum or '', p.messdiener_text or '', p.art_uhrzeit or '') for p in plan)
+    ids['plan'] = dict(zip(keyed['plan'], (p.id for p in plan)))
+    return keyed, ids
+
+
+def _three_way(base, gist, current):
+    """Liefert (upserts, deletes, conflicts) für die DB; upserts in Gist-Reihenfolge."""
+    upserts, deletes, conflicts = {}, [], []
+    for key in itertools.chain(gist, (k for k in base if k not in gist)):
+        b, g = base.get(key, _MISSING), gist.get(key, _MISSING)
+        if g == b:
+            continue  # im Gist unverändert -> DB-Stand gilt
+        d = current.get(key, _MISSING)
+        if d == g:
+            continue  # bereits angekommen
+        if d == b:
+            if g is _MISSING:
+                deletes.append(key)
+            else:
+                upserts[key] = g
+        else:
+            conflicts.append((key, g, d))
+    return upserts, deletes, conflicts
+
+
+def _apply_reconcile(db, diff, ids, report, gist_plan, current_plan):
+    queues_up, queues_del, _ = diff['queues']
+    enroll_up, enroll_del, _ = diff['enrollments']
+    plan_up, plan_del, plan_conflicts = diff['plan']
+    touched = set()
+
+    # Queues (Schlüssel: ID)
+    new_queues = [{'id': int(k), 'name': v[0], 'capacity': v[1]} for k, v in queues_up.items() if k not in ids['queues']]
+    db.bulk_insert_mappings(Queue, new_queues)
+    db.bulk_update_mappings(Queue, [{'id': ids['queues'][k], 'name': v[0], 'capacity': v[1]}
+                                    for k, v in queues_up.items() if k in ids['queues']])
+    if new_queues and db.get_bind().dialect.name == 'postgresql':
+        # Explizit vergebene IDs: Sequenz nachziehen, damit neue Queues nicht kollidieren
+        db.execute(sql_text("SELECT setval(pg_get_serial_sequence('queues', 'id'), (SELECT MAX(id) FROM queues))"))
+    touched.update(queues_up)
+    report['queues'] = {'inserted': len(new_queues), 'updated': len(queues_up) - len(new_queues), 'deleted': len(queues_del)}
+
+    # Eintragungen (Schlüssel: Person + Queue)
+    existing_queues = (set(ids['queues']) | set(queues_up)) - set(queues_del)
+    new_enrollments = []
+    for (person, qid), (ts, waitlisted) in enroll_up.items():
+        if (person, qid) in ids['enrollments']:
+            continue
+        if qid not in existing_queues:
+            report['conflicts'].append({'area': 'enrollments', 'key': [person, qid], 'reason': 'Queue existiert nicht'})
+            continue
+        new_enrollments.append({'person': person, 'queue_id': int(qid), 'timestamp': ts, 'waitlisted': waitlisted})
+    # In Gist-Reihenfolge einfügen -> Reihenfolge der Warteliste bleibt erhalten
+    db.bulk_insert_mappings(Enrollment, new_enrollments)
+    updated = [{'id': ids['enrollments'][k], 'timestamp': v[0], 'waitlisted': v[1]}
+               for k, v in enroll_up.items() if k in ids['enrollments']]
+    db.bulk_update_mappings(Enrollment, updated)
+    del_ids = [ids['enrollments'][k] for k in enroll_del]
+    for i in range(0, len(del_ids), 500):
+        db.query(Enrollment).filter(Enrollment.id.in_(del_ids[i:i + 500])).delete(synchronize_session=False)
+    touched.update(k[1] for k in list(enroll_up) + enroll_del)
+    report['enrollments'] = {'inserted': len(new_enrollments), 'updated': len(updated), 'deleted': len(del_ids)}
+
+    for qid in queues_del:
+        _db_delete_queue(db, qid)
+
+    # Plan (Schlüssel: Datum + Art/Uhrzeit + laufende Nummer)
+    new_rows = [{'datum': k[0], 'messdiener_text': v, 'art_uhrzeit': k[1]} for k, v in plan_up.items() if k not in ids['plan']]
+    del_ids = [ids['plan'][k] for k in plan_del]
+    if (plan_up or plan_del) and not plan_conflicts:
+        # Der Plan ist eine geordnete Liste: neu in Gist-Reihenfolge schreiben, damit z. B. eine
+        # korrigierte Zeile nicht ans Ende wandert. Werte aus der DB bleiben erhalten, wo das Gist
+        # nichts geändert hat; nur in der DB vorhandene Zeilen folgen am Ende.
+        merged = [(k, plan_up.get(k, current_plan.get(k, _MISSING))) for k in gist_plan]
+        merged += [(k, v) for k, v in current_plan.items() if k not in gist_plan and k not in plan_del]
+        _db_save_plan(db, [['Datum', 'Messdiener', 'Art/Uhrzeit']] + [[k[0], v, k[1]] for k, v in merged if v is not _MISSING])
+    else:
+        # Bei Konflikten gezielt ändern, damit der DB-Stand der Konfliktzeilen gilt; neue Zeilen werden angehängt
+        db.bulk_insert_mappings(PlanEntry, new_rows)
+        db.bulk_update_mappings(PlanEntry, [{'id': ids['plan'][k], 'messdiener_text': v} for k, v in plan_up.items() if k in ids['plan']])
+        for i in range(0, len(del_ids), 500):
+            db.query(PlanEntry).filter(PlanEntry.id.in_(del_ids[i:i + 500])).delete(synchronize_session=False)
+    report['plan'] = {'inserted': len(new_rows), 'updated': len(plan_up) - len(new_rows), 'deleted': len(del_ids)}
+
+    db.flush()
+    for qid in touched - set(queues_del):
+        q = _lock_queue(db, qid)
+        if q is not None:
+            _db_promote_waitlist(db, q)
+
+
+def reconcile_gist_into_db(dry_run=False):
+    """Überträgt Änderungen aus der Gist-Phase inkrementell in die DB (idempotent).
+    Liefert einen Bericht mit Anzahl je Bereich und Konflikten oder None, wenn Gist oder DB nicht verfügbar sind."""
+    if not gist_configured():
+        return None
+    with _reconcile_lock:
+        state = load_gist_state()
+        if state is None:
+            # Gist nicht lesbar: weder DB noch Basis anfassen, sonst gälten Zeilen als gelöscht
+            return None
+        content, content_hash = _canonical_state(state)
+        report = {'skipped': False, 'conflicts': []}
+        db = WriteSessionLocal()
+        try:
+            base_row = db.get(GistSyncBase, 1)
+            if base_row is not None and base_row.content_hash == content_hash:
+                # Gist seit dem letzten Abgleich unverändert
+                report['skipped'] = True
+                return report
+            if base_row is None and not USE_GIST:
+                # Erster Lauf ohne Fallback-Phase: der Gist kann beliebig alt sein -> nur als Basis übernehmen
+                report['baseline'] = True
+                if not dry_run:
+                    _store_gist_base(db, state)
+                    db.commit()
+                return report
+            base = _gist_keyed(json.loads(base_row.content)) if base_row is not None else {'queues': {}, 'enrollments': {}, 'plan': {}}
+            gist = _gist_keyed(state)
+            current, ids = _db_keyed(db)
+            diff = {area: _three_way(base[area], gist[area], current[area]) for area in gist}
+            for area, (_, _, conflicts) in diff.items():
+                for key, g, d in conflicts:
+                    report['conflicts'].append({
+                        'area': area, 'key': list(key) if isinstance(key, tuple) else key,
+                        'gist': None if g is _MISSING else g, 'db': None if d is _MISSING else d,
+                    })
+            _apply_reconcile(db, diff, ids, report, gist['plan'], current['plan'])
+            if dry_run:
+                db.rollback()
+                return report
+            # Konflikte werden einmal gemeldet; mit der neuen Basis gilt danach der DB-Stand
+            _store_gist_base(db, state)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Gist-Abgleich nicht möglich (DB nicht erreichbar?): {e}")
+            return None
+        finally:
+            db.close()
+    changed = sum(report[area][k] for area in ('queues', 'enrollments', 'plan') for k in ('inserted', 'updated', 'deleted'))
+    logger.info(f"Gist-Abgleich: {changed} Änderungen übernommen, {len(report['conflicts'])} Konflikte.")
+    for conflict in report['conflicts']:
+        logger.warning(f"Gist-Abgleich Konflikt: {conflict}")
+    if changed:
+        schedule_static_publish()
+    return report
+
+
+def _switch_to_db():
+    global USE_GIST
+    USE_GIST = False
+    logger.warning("DB wieder erreichbar – Gist-Fallback beendet.")
+
+
+def _gist_reconcile_loop():
+    while True:
+        if USE_GIST:
+            # DB zurück? Schema sicherstellen, Gist-Änderungen übernehmen, dann umschalten
+            try:
+                ensure_schema()
+            except Exception:
+                time.sleep(GIST_RECONCILE_INTERVAL)
+                continue
+            # Ins Gist gespiegelte Einträge sind älter als offen gebliebene: erst abgleichen, dann
+            # nachtragen. Die Sperre hält die Spiegelung an, bis umgeschaltet ist.
+            with _gist_write_lock:
+                switched = reconcile_gist_into_db() is not None
+                if switched:
+                    _switch_to_db()
+            if switched:
+                replay_journal()
+        else:
+            reconcile_gist_into_db()
+        time.sleep(GIST_RECONCILE_INTERVAL)
+
+
+@app.cli.command('reconcile-gist')
+@click.option('--dry-run', is_flag=True, help='Nur berichten, nichts in die DB schreiben.')
+def reconcile_gist_command(dry_run):
+    """Gleicht Änderungen aus dem Gist mit der DB ab."""
+    report = reconcile_gist_into_db(dry_run=dry_run)
+    if report is None:
+        raise click.ClickException('Gist nicht konfiguriert oder DB nicht erreichbar.')
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+
 
 # CSV einlesen
 def load_plan():
@@ -651,13 +1784,299 @@ def count_user_enrollments(enrollments, person):
     return len(queue_ids)
 
 
+# --- Admission Control / Rate Limiting ---
+# Token-Bucket pro Client-IP bzw. Name; Grenzwerte: (Burst, Anfragen pro Minute)
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')  # 'memory' oder 'db'
+RATE_LIMITS = {
+    'enroll_ip': (int(os.environ.get('RATE_LIMIT_ENROLL_IP_BURST', 10)),
+                  float(os.environ.get('RATE_LIMIT_ENROLL_IP_PER_MIN', 10))),
+    'enroll_name': (int(os.environ.get('RATE_LIMIT_ENROLL_NAME_BURST', 4)),
+                    float(os.environ.get('RATE_LIMIT_ENROLL_NAME_PER_MIN', 2))),
+    'login_ip': (int(os.environ.get('RATE_LIMIT_LOGIN_IP_BURST', 5)),
+                 float(os.environ.get('RATE_LIMIT_LOGIN_IP_PER_MIN', 1))),
+    'admin_ip': (int(os.environ.get('RATE_LIMIT_ADMIN_IP_BURST', 30)),
+                 float(os.environ.get('RATE_LIMIT_ADMIN_IP_PER_MIN', 30))),
+}
+# Gleichzeitig laufende Schreib-Requests; weitere warten höchstens WRITE_QUEUE_TIMEOUT Sekunden
+WRITE_CONCURRENCY = int(os.environ.get('WRITE_CONCURRENCY', 4))
+WRITE_QUEUE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_TIMEOUT', 2))
+_MEMORY_BUCKETS_MAX = 10000
+# Alle so viele take()-Aufrufe räumt DbBucketStore abgelaufene Zeilen ab
+_DB_BUCKETS_PRUNE_EVERY = 500
+
+
+def _bucket_horizon():
+    # Nach dieser Zeit (Sekunden) ist jeder Bucket sicher wieder voll und kann entfallen
+    return max(capacity * 60.0 / per_minute for capacity, per_minute in RATE_LIMITS.values())
+
+
+class MemoryBucketStore:
+    """Token-Buckets im Prozessspeicher (Standard, ein Worker)."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_second, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(capacity), now))
+            tokens = min(float(capacity), tokens + (now - updated) * per_second)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / per_second
+            if len(self._buckets) > _MEMORY_BUCKETS_MAX:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # Buckets, die inzwischen sicher wieder voll wären, verwerfen
+        horizon = _bucket_horizon()
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < horizon}
+
+
+class DbBucketStore:
+    """Token-Buckets in der Datenbank, damit mehrere Worker dieselben Grenzen teilen."""
+
+    def __init__(self):
+        self._takes = itertools.count(1)
+
+    def take(self, key, capacity, per_second, now):
+        # Schlüssel enthalten frei wählbare Namen -> Tabelle regelmäßig abräumen
+        if next(self._takes) % _DB_BUCKETS_PRUNE_EVERY == 0:
+            self._prune(now)
+        db = WriteSessionLocal()
+        try:
+            bucket = db.query(RateLimitBucket).filter_by(key=key).with_for_update().one_or_none()
+            if bucket is None:
+                bucket = RateLimitBucket(key=key, tokens=float(capacity), updated=now)
+                db.add(bucket)
+            tokens = min(float(capacity), bucket.tokens + (now - bucket.updated) * per_second)
+            if tokens >= 1:
+                bucket.tokens, wait = tokens - 1, 0.0
+            else:
+                bucket.tokens, wait = tokens, (1 - tokens) / per_second
+            bucket.updated = now
+            db.commit()
+            return wait
+        finally:
+            db.close()
+
+    def _prune(self, now):
+        db = WriteSessionLocal()
+        try:
+            removed = db.query(RateLimitBucket).filter(RateLimitBucket.updated < now - _bucket_horizon()).delete(synchronize_session=False)
+            db.commit()
+            if removed:
+                logger.info(f"Rate-Limit: {removed} abgelaufene Buckets entfernt.")
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Rate-Limit-Buckets konnten nicht abgeräumt werden: {e}")
+        finally:
+            db.close()
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+        self._fallback = MemoryBucketStore()
+
+    def take(self, key, capacity, per_minute):
+        """Verbraucht ein Token; liefert 0 oder die Wartezeit in Sekunden bis zum nächsten Token."""
+        per_second = per_minute / 60.0
+        now = time.time()
+        try:
+            return self.store.take(key, capacity, per_second, now)
+        except Exception as e:
+            # Gemeinsamer Speicher nicht erreichbar -> lokal weiterzählen statt alles zu blockieren
+            logger.warning(f"Rate-Limit-Speicher nicht verfügbar, nutze Prozessspeicher: {e}")
+            return self._fallback.take(key, capacity, per_second, now)
+
+
+rate_limiter = RateLimiter(DbBucketStore() if RATE_LIMIT_STORE == 'db' else MemoryBucketStore())
+write_gate = threading.BoundedSemaphore(WRITE_CONCURRENCY)
+
+
+def _client_ip():
+    return request.remote_addr or 'unbekannt'
+
+
+def _enroll_name_key():
+    return request.form.get('name', '').strip().lower()
+
+
+def _too_many_requests(retry_after):
+    retry_after = max(1, int(retry_after + 0.999))
+    return (f'Zu viele Anfragen – bitte in {retry_after} Sekunden erneut versuchen.', 429,
+            {'Retry-After': str(retry_after), 'Content-Type': 'text/plain; charset=utf-8'})
+
+
+def admission_control(*rules):
+    """Begrenzt POST-Requests per Token-Bucket (rules: (Limit-Name, Key-Funktion))
+    und lässt nur WRITE_CONCURRENCY Schreibzugriffe gleichzeitig durch."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method != 'POST' or not RATE_LIMIT_ENABLED:
+                return view(*args, **kwargs)
+            for limit_name, key_func in rules:
+                key = key_func()
+                if not key:
+                    continue
+                capacity, per_minute = RATE_LIMITS[limit_name]
+                wait = rate_limiter.take(f'{limit_name}:{key}', capacity, per_minute)
+                if wait > 0:
+                    logger.warning(f"Rate-Limit '{limit_name}' erreicht für {key}")
+                    return _too_many_requests(wait)
+            if not write_gate.acquire(timeout=WRITE_QUEUE_TIMEOUT):
+                logger.warning(f"Schreib-Gate voll ({WRITE_CONCURRENCY}) – Anfrage abgewiesen")
+                return _too_many_requests(1)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                write_gate.release()
+        return wrapped
+    return decorator
+
+
+# --- Statische Assets (lokal, mit Content-Hash im Dateinamen) ---
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_FALLBACK_MAX_AGE = 24 * 3600
+# Vorkomprimierte Varianten (erzeugt von build_assets.py), in Reihenfolge der Präferenz
+PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _build_asset_manifest():
+    # 'css/index.css' -> 'css/index.<hash>.css'
+    manifest = {}
+    for root, _dirs, files in os.walk(STATIC_DIR):
+        for fn in files:
+            if fn.endswith(('.gz', '.br')):
+                continue
+            full = os.path.join(root, fn)
+            rel = os.path.relpath(full, STATIC_DIR).replace(os.sep, '/')
+            with open(full, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            base, ext = os.path.splitext(rel)
+            manifest[rel] = f'{base}.{digest}{ext}'
+    return manifest
+
+
+ASSET_MANIFEST = _build_asset_manifest()
+_ASSET_SOURCES = {v: k for k, v in ASSET_MANIFEST.items()}
+
+
+@app.template_global()
+def asset_url(path):
+    global ASSET_MANIFEST, _ASSET_SOURCES
+    if os.environ.get('FLASK_ENV') == 'development':
+        # In der Entwicklung geänderte Dateien sofort berücksichtigen
+        ASSET_MANIFEST = _build_asset_manifest()
+        _ASSET_SOURCES = {v: k for k, v in ASSET_MANIFEST.items()}
+    return url_for('asset', filename=ASSET_MANIFEST.get(path, path))
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    source = _ASSET_SOURCES.get(filename)
+    fingerprinted = source is not None
+    full = safe_join(STATIC_DIR, source or filename)
+    if not full or not os.path.isfile(full):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(full)[0] or 'application/octet-stream'
+    content_encoding = None
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        if request.accept_encodings[encoding] and os.path.isfile(full + suffix):
+            full, content_encoding = full + suffix, encoding
+            break
+
+    # Fingerprint-Namen ändern sich nie -> dauerhaft cachen; andere Dateien (z.B. Schriften,
+    # die relativ aus bootstrap-icons.css geladen werden) nur einen Tag
+    max_age = ASSET_MAX_AGE if fingerprinted else ASSET_FALLBACK_MAX_AGE
+    response = send_file(full, mimetype=mimetype, conditional=True, max_age=max_age)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    if fingerprinted:
+        response.cache_control.immutable = True
+    return response
+
+
+# --- Antwort-Komprimierung (gzip, Brotli falls installiert) ---
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_CACHE_ENTRIES = int(os.environ.get('COMPRESS_CACHE_ENTRIES', 64))
+COMPRESS_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript', 'text/javascript'}
+
+# Komprimierte Bodies unveränderter Seiten: (Encoding, SHA-1 des Bodys) -> Bytes
+_compress_cache = OrderedDict()
+_compress_cache_lock = threading.Lock()
+
+
+def _choose_encoding():
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_body(data, encoding):
+    key = (encoding, hashlib.sha1(data).digest())
+    with _compress_cache_lock:
+        cached = _compress_cache.get(key)
+        if cached is not None:
+            _compress_cache.move_to_end(key)
+            return cached
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=5)
+    else:
+        compressed = gzip.compress(data, compresslevel=6, mtime=0)
+    with _compress_cache_lock:
+        _compress_cache[key] = compressed
+        while len(_compress_cache) > COMPRESS_CACHE_ENTRIES:
+            _compress_cache.popitem(last=False)
+    return compressed
+
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(_compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
 @app.route('/queues', methods=['GET'])
 def queues_view():
-    queues, enroll_by_queue = storage_get_queues_and_enrollments()
-    return render_template('queues.html', queues=queues, enroll_by_queue=enroll_by_queue)
+    queues, enroll_by_queue, waitlist_by_queue = storage_get_queues_and_enrollments()
+    return render_template('queues.html', queues=queues, enroll_by_queue=enroll_by_queue,
+                           waitlist_by_queue=waitlist_by_queue)
 
 
 @app.route('/queues/enroll', methods=['POST'])
+@admission_control(('enroll_ip', _client_ip), ('enroll_name', _enroll_name_key))
 def queues_enroll():
     name = request.form.get('name', '').strip()
     qid = request.form.get('queue_id', '').strip()
@@ -670,7 +2089,19 @@ def queues_enroll():
     return redirect(url_for('queues_view'))
 
 
+def _parse_capacity(value):
+    """Leer -> None (unbegrenzt), sonst positive Ganzzahl; wirft ValueError."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    capacity = int(value)
+    if capacity < 1:
+        raise ValueError(value)
+    return capacity
+
+
 @app.route('/admin/queues', methods=['GET', 'POST'])
+@admission_control(('admin_ip', _client_ip))
 def admin_queues():
     if not session.get('admin'):
         flash('Sie müssen sich als Administrator anmelden!', 'error')
@@ -682,8 +2113,45 @@ def admin_queues():
             if not name:
                 flash('Name der Warteschlange darf nicht leer sein.', 'error')
                 return redirect(url_for('admin_queues'))
-            storage_admin_add_queue(name)
-            flash('Warteschlange hinzugefügt.', 'success')
+            try:
+                capacity = _parse_capacity(request.form.get('capacity', ''))
+            except ValueError:
+                flash('Kapazität muss eine positive Zahl sein (leer = unbegrenzt).', 'error')
+                return redirect(url_for('admin_queues'))
+            if storage_admin_add_queue(name, capacity):
+                flash('Warteschlange hinzugefügt.', 'success')
+            else:
+                flash(WRITE_FAILED_MSG, 'error')
+            return redirect(url_for('admin_queues'))
+
+        if 'set_capacity' in request.form:
+            qid = request.form.get('queue_id', '').strip()
+            try:
+                qid_int = int(qid)
+                capacity = _parse_capacity(request.form.get('capacity', ''))
+            except ValueError:
+                flash('Ungültige Queue-ID oder Kapazität.', 'error')
+                return redirect(url_for('admin_queues'))
+            found = storage_admin_set_capacity(qid_int, capacity)
+            if found:
+                flash('Kapazität gespeichert.', 'success')
+            else:
+                flash(WRITE_FAILED_MSG if found is None else 'Warteschlange nicht gefunden.', 'error')
+            return redirect(url_for('admin_queues'))
+
+        if 'remove_enrollment' in request.form:
+            qid = request.form.get('queue_id', '').strip()
+            person = request.form.get('person', '').strip()
+            try:
+                qid_int = int(qid)
+            except Exception:
+                flash('Ungültige Queue-ID.', 'error')
+                return redirect(url_for('admin_queues'))
+            removed = storage_admin_remove_enrollment(qid_int, person) if person else False
+            if removed:
+                flash(f'{person} wurde ausgetragen.', 'info')
+            else:
+                flash(WRITE_FAILED_MSG if removed is None else 'Eintrag nicht gefunden.', 'error')
             return redirect(url_for('admin_queues'))
 
         if 'delete_queue' in request.form:
@@ -693,8 +2161,10 @@ def admin_queues():
             except Exception:
                 flash('Ungültige Queue-ID.', 'error')
                 return redirect(url_for('admin_queues'))
-            storage_admin_delete_queue(qid_int)
-            flash('Warteschlange gelöscht.', 'info')
+            if storage_admin_delete_queue(qid_int):
+                flash('Warteschlange gelöscht.', 'info')
+            else:
+                flash(WRITE_FAILED_MSG, 'error')
             return redirect(url_for('admin_queues'))
 
         if 'clear_enrollments' in request.form:
@@ -704,13 +2174,16 @@ def admin_queues():
             except Exception:
                 flash('Ungültige Queue-ID.', 'error')
                 return redirect(url_for('admin_queues'))
-            storage_admin_clear_enrollments(qid_int)
-            flash('Einträge der Warteschlange geleert.', 'info')
+            if storage_admin_clear_enrollments(qid_int):
+                flash('Einträge der Warteschlange geleert.', 'info')
+            else:
+                flash(WRITE_FAILED_MSG, 'error')
             return redirect(url_for('admin_queues'))
 
     # Für Anzeige vorbereiten
-    queues, enroll_by_queue = storage_get_queues_and_enrollments()
-    return render_template('admin_queues.html', queues=queues, enroll_by_queue=enroll_by_queue)
+    queues, enroll_by_queue, waitlist_by_queue = storage_get_queues_and_enrollments()
+    return render_template('admin_queues.html', queues=queues, enroll_by_queue=enroll_by_queue,
+                           waitlist_by_queue=waitlist_by_queue)
 
 @app.route('/')
 def index():
@@ -718,6 +2191,7 @@ def index():
     return render_template('index.html', plan=plan)
 
 @app.route('/login', methods=['GET', 'POST'])
+@admission_control(('login_ip', _client_ip))
 def login():
     try:
         if request.method == 'POST':
@@ -741,6 +2215,7 @@ def login():
         return render_template('login.html')
 
 @app.route('/edit', methods=['GET', 'POST'])
+@admission_control(('admin_ip', _client_ip))
 def edit():
     if not session.get('admin'):
         flash('Sie müssen sich als Administrator anmelden!', 'error')
@@ -753,8 +2228,10 @@ def edit():
             # Stelle sicher, dass die neue Zeile die aktuelle Spaltenanzahl hat
             expected_cols = len(plan[0]) if plan and len(plan) > 0 else 3
             plan.append([''] * expected_cols)
-            save_plan_db(plan)
-            flash('Neue Zeile hinzugefügt!', 'success')
+            if save_plan_db(plan):
+                flash('Neue Zeile hinzugefügt!', 'success')
+            else:
+                flash(WRITE_FAILED_MSG, 'error')
             return redirect(url_for('edit'))
 
         # Plan speichern
@@ -772,12 +2249,404 @@ def edit():
                 if datum or messdiener_text or art_zeit:  # Nur speichern wenn mindestens ein Feld ausgefüllt
                     new_plan.append([datum, messdiener_text, art_zeit])
 
-            save_plan_db(new_plan)
+            if not save_plan_db(new_plan):
+                flash(WRITE_FAILED_MSG, 'error')
+                return redirect(url_for('edit'))
             flash('Plan erfolgreich gespeichert!', 'success')
             return redirect(url_for('index'))
 
     return render_template('edit.html', plan=plan)
 
+# --- Plan-Import (CSV/XLSX) und Teil-Updates ---
+PLAN_FIELD_LIMITS = (50, None, 100)  # Spaltenlängen wie in PlanEntry
+PLAN_UPLOAD_MAX_ERRORS = 10
+
+
+def _validate_plan_row(row, line_no, strict_date=False):
+    errors = []
+    for value, limit, label in zip(row, PLAN_FIELD_LIMITS, ('Datum', 'Messdiener', 'Art/Uhrzeit')):
+        if limit and len(value) > limit:
+            errors.append(f'Zeile {line_no}: {label} länger als {limit} Zeichen.')
+    if strict_date and row[0]:
+        try:
+            datetime.strptime(row[0], '%d.%m.%Y')
+        except ValueError:
+            errors.append(f'Zeile {line_no}: Ungültiges Datum "{row[0]}" (erwartet TT.MM.JJJJ).')
+    return errors
+
+
+def _iter_upload_rows(file_storage):
+    """Liest eine hochgeladene CSV- oder XLSX-Datei zeilenweise (ohne alles in den Speicher zu laden)."""
+    filename = (file_storage.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError('XLSX-Import benötigt das Paket openpyxl.')
+        wb = load_workbook(file_storage.stream, read_only=True, data_only=True)
+        try:
+            for values in wb.active.iter_rows(values_only=True):
+                row = []
+                for v in values[:3]:
+                    if v is None:
+                        row.append('')
+                    elif isinstance(v, datetime):
+                        row.append(v.strftime('%d.%m.%Y'))
+                    else:
+                        row.append(str(v))
+                yield row
+        finally:
+            wb.close()
+        return
+    if not filename.endswith('.csv'):
+        raise ValueError('Nur CSV- oder XLSX-Dateien werden unterstützt.')
+    text = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    first = text.readline()
+    # Excel exportiert in deutscher Einstellung mit Semikolon
+    delimiter = ';' if first.count(';') > first.count(',') else ','
+    for row in csv.reader(itertools.chain([first], text), delimiter=delimiter):
+        yield row
+
+
+def parse_plan_upload(file_storage):
+    """Validiert eine Plan-Datei; liefert (plan_rows, errors)."""
+    plan_rows = [['Datum', 'Messdiener', 'Art/Uhrzeit']]
+    errors = []
+    try:
+        for line_no, raw in enumerate(_iter_upload_rows(file_storage), start=1):
+            row = [(c or '').strip() for c in raw[:3]]
+            row += [''] * (3 - len(row))
+            if line_no == 1 and row[0].lower() == 'datum':
+                continue  # Kopfzeile
+            if not any(row):
+                continue
+            errors.extend(_validate_plan_row(row, line_no, strict_date=True))
+            if len(errors) >= PLAN_UPLOAD_MAX_ERRORS:
+                errors.append('Weitere Fehler wurden nicht geprüft.')
+                break
+            plan_rows.append(row)
+    except UnicodeDecodeError:
+        errors.append('Datei ist nicht UTF-8-kodiert.')
+    except ValueError as e:
+        errors.append(str(e))
+    except Exception as e:
+        logger.warning(f"Fehler beim Lesen der Plan-Datei: {e}")
+        errors.append('Datei konnte nicht gelesen werden.')
+    return plan_rows, errors
+
+
+@app.route('/edit/upload', methods=['POST'])
+@admission_control(('admin_ip', _client_ip))
+def edit_upload():
+    if not session.get('admin'):
+        flash('Sie müssen sich als Administrator anmelden!', 'error')
+        return redirect(url_for('login'))
+
+    file_storage = request.files.get('plan_file')
+    if not file_storage or not file_storage.filename:
+        flash('Bitte eine CSV- oder XLSX-Datei auswählen.', 'error')
+        return redirect(url_for('edit'))
+
+    plan_rows, errors = parse_plan_upload(file_storage)
+    if errors:
+        for msg in errors:
+            flash(msg, 'error')
+        flash('Import abgebrochen – der Plan wurde nicht verändert.', 'error')
+        return redirect(url_for('edit'))
+
+    if request.form.get('mode') == 'append':
+        current = get_plan_list()
+        saved = save_plan_db(current + plan_rows[1:])
+    else:
+        saved = save_plan_db(plan_rows)
+    if saved:
+        flash(f'{len(plan_rows) - 1} Zeilen importiert.', 'success')
+    else:
+        flash(WRITE_FAILED_MSG, 'error')
+    return redirect(url_for('edit'))
+
+
+@app.route('/edit/batch', methods=['POST'])
+@admission_control(('admin_ip', _client_ip))
+def edit_batch():
+    """JSON-Teil-Update: {"row_count": n, "rows": [{"index": i, "datum", "messdiener", "art_zeit"}]}"""
+    if not session.get('admin'):
+        return jsonify({'ok': False, 'error': 'Nicht angemeldet.'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    rows = payload.get('rows')
+    if not isinstance(rows, list):
+        return jsonify({'ok': False, 'error': 'Feld "rows" fehlt.'}), 400
+
+    # Zeilen sind über ihre Position identifiziert -> nur anwenden, wenn der Plan unverändert lang ist
+    current_count = len(get_plan_list()) - 1
+    if payload.get('row_count') is not None and payload.get('row_count') != current_count:
+        return jsonify({'ok': False, 'error': 'Der Plan wurde zwischenzeitlich geändert. Bitte Seite neu laden.'}), 409
+
+    changes = {}
+    errors = []
+    for item in rows:
+        try:
+            idx = int(item.get('index'))
+        except Exception:
+            errors.append('Ungültiger Zeilenindex.')
+            continue
+        if idx < 1:
+            errors.append(f'Ungültiger Zeilenindex {idx}.')
+            continue
+        row = [str(item.get(k) or '').strip() for k in ('datum', 'messdiener', 'art_zeit')]
+        errors.extend(_validate_plan_row(row, idx))
+        changes[idx] = row
+    if errors:
+        return jsonify({'ok': False, 'errors': errors}), 400
+
+    counts = storage_update_plan_rows(changes) if changes else {'updated': 0, 'inserted': 0, 'deleted': 0}
+    if counts is None:
+        return jsonify({'ok': False, 'error': WRITE_FAILED_MSG}), 503
+    flash('Plan erfolgreich gespeichert!', 'success')
+    return jsonify({'ok': True, **counts})
+
+
+# --- Statischer Export der öffentlichen Seiten (optional) ---
+# Nach jeder Änderung werden Startseite, Warteschlangen und JSON-Snapshots in STATIC_EXPORT_DIR
+# geschrieben, sodass ein beliebiger Webserver/CDN sie ohne Python ausliefern kann.
+STATIC_EXPORT_DIR = os.environ.get('STATIC_EXPORT_DIR')
+# Adresse der laufenden App, an die das Eintragungs-Formular der exportierten Seite sendet
+STATIC_EXPORT_APP_URL = os.environ.get('STATIC_EXPORT_APP_URL', '').rstrip('/')
+
+_publish_event = threading.Event()
+_publish_thread = None
+_publish_lock = threading.Lock()
+
+
+@app.context_processor
+def _static_export_defaults():
+    return {'static_export': False, 'app_url': ''}
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _write_export_file(out_dir, rel_path, data, compress=True):
+    path = os.path.join(out_dir, *rel_path.split('/'))
+    _write_atomic(path, data)
+    if compress:
+        _write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+
+
+def _copy_if_changed(src, target, immutable=False):
+    if immutable and os.path.exists(target):
+        return
+    with open(src, 'rb') as f:
+        data = f.read()
+    if os.path.exists(target):
+        with open(target, 'rb') as f:
+            if f.read() == data:
+                return
+    _write_atomic(target, data)
+
+
+def publish_static_site(out_dir=None):
+    """Rendert die öffentlichen Seiten (ohne Admin-Elemente) und JSON-Snapshots nach out_dir.
+    Jede Datei wird atomar ersetzt; HTML zuletzt, damit es nie auf fehlende Assets verweist."""
+    out_dir = out_dir or STATIC_EXPORT_DIR
+    if not out_dir:
+        return False
+    with _publish_lock:
+        plan = get_plan_list()
+        queues, enroll_by_queue, waitlist_by_queue = storage_get_queues_and_enrollments()
+
+        # 1. Assets unter ihren Fingerprint-Namen (und Originalpfaden für relative Verweise)
+        for source, hashed in ASSET_MANIFEST.items():
+            src = os.path.join(STATIC_DIR, *source.split('/'))
+            for rel in (hashed, source):
+                target = os.path.join(out_dir, 'assets', *rel.split('/'))
+                # Fingerprint-Namen ändern ihren Inhalt nie; Originalpfade schon -> dort vergleichen
+                immutable = rel != source
+                for suffix in ('', '.gz', '.br'):
+                    if os.path.exists(src + suffix):
+                        _copy_if_changed(src + suffix, target + suffix, immutable)
+                    elif suffix and not immutable and os.path.exists(target + suffix):
+                        os.remove(target + suffix)  # veraltete Vorkomprimierung
+
+        # 2. JSON-Snapshots
+        generated = datetime.now().isoformat(timespec='seconds')
+        plan_json = {'generated': generated, 'plan': plan}
+        queues_json = {
+            'generated': generated,
+            'queues': [{'id': q[0], 'name': q[1],
+                        'capacity': int(q[2]) if len(q) > 2 and str(q[2]).isdigit() else None,
+                        'enrollments': enroll_by_queue.get(q[0], []),
+                        'waitlist': waitlist_by_queue.get(q[0], [])}
+                       for q in queues[1:] if len(q) >= 2],
+        }
+        _write_export_file(out_dir, 'plan.json', json.dumps(plan_json, ensure_ascii=False).encode('utf-8'))
+        _write_export_file(out_dir, 'queues.json', json.dumps(queues_json, ensure_ascii=False).encode('utf-8'))
+
+        # 3. HTML (ohne Session -> keine Admin-Elemente)
+        with app.test_request_context('/'):
+            context = {'static_export': True, 'app_url': STATIC_EXPORT_APP_URL}
+            index_html = render_template('index.html', plan=plan, **context)
+            queues_html = render_template('queues.html', queues=queues, enroll_by_queue=enroll_by_queue,
+                                          waitlist_by_queue=waitlist_by_queue, **context)
+        _write_export_file(out_dir, 'queues/index.html', queues_html.encode('utf-8'))
+        _write_export_file(out_dir, 'index.html', index_html.encode('utf-8'))
+    return True
+
+
+def _publish_loop():
+    while True:
+        _publish_event.wait()
+        # Kurz sammeln, damit ein Schwung Eintragungen nur einen Export auslöst
+        time.sleep(1)
+        _publish_event.clear()
+        try:
+            publish_static_site()
+        except Exception as e:
+            logger.warning(f"Statischer Export fehlgeschlagen: {e}")
+
+
+def schedule_static_publish():
+    global _publish_thread
+    if not STATIC_EXPORT_DIR:
+        return
+    if _publish_thread is None:
+        _publish_thread = threading.Thread(target=_publish_loop, name='static-export', daemon=True)
+        _publish_thread.start()
+    _publish_event.set()
+
+
+@app.cli.command('export-static')
+@click.option('--out', 'out_dir', default=None, help='Zielverzeichnis (Standard: STATIC_EXPORT_DIR)')
+def export_static_command(out_dir):
+    """Erzeugt den statischen Export der öffentlichen Seiten."""
+    out_dir = out_dir or STATIC_EXPORT_DIR
+    if not out_dir:
+        raise click.UsageError('Kein Zielverzeichnis: --out angeben oder STATIC_EXPORT_DIR setzen.')
+    publish_static_site(out_dir)
+    click.echo(f'Statischer Export geschrieben nach {out_dir}')
+
+
+# --- Suche im Plan ---
+import math
+import re
+
+SEARCH_PER_PAGE = 20
+# Sortierschlüssel JJJJMMTT aus TT.MM.JJJJ (funktioniert in SQLite und PostgreSQL)
+_DATE_SORT_SQL = "substr(p.datum, 7, 4) || substr(p.datum, 4, 2) || substr(p.datum, 1, 2)"
+
+
+def _search_terms(query):
+    # Nur Wortzeichen -> keine Sonderzeichen der FTS-Abfragesprachen
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+def _search_plan_fallback(terms, year, sort):
+    # Ohne DB-Index (Gist-Modus, SQLite ohne FTS5): linear über den Plan
+    results = []
+    for datum, mess, art in (r + [''] * (3 - len(r)) for r in storage_get_plan()[1:]):
+        if year and not datum.endswith(f'.{year}'):
+            continue
+        words = re.findall(r'\w+', f'{mess} {art}'.lower())
+        score = sum(1 for t in terms for w in words if w.startswith(t))
+        if terms and not all(any(w.startswith(t) for w in words) for t in terms):
+            continue
+        results.append({'datum': datum, 'messdiener': mess, 'art_uhrzeit': art, 'score': score})
+    date_key = lambda r: r['datum'][6:10] + r['datum'][3:5] + r['datum'][0:2]
+    if sort == 'datum' or not terms:
+        results.sort(key=date_key, reverse=True)
+    else:
+        results.sort(key=lambda r: (r['score'], date_key(r)), reverse=True)
+    return results
+
+
+def search_plan(query, year=None, sort='relevanz', page=1, per_page=SEARCH_PER_PAGE):
+    """Volltextsuche über Messdiener und Art/Uhrzeit; liefert eine Seite gerankter Treffer."""
+    terms = _search_terms(query or '')
+    page = max(1, page)
+    result = {'results': [], 'total': 0, 'page': page, 'pages': 0}
+    if not terms and not year:
+        return result
+
+    rows = None
+    if not (USE_GIST and gist_configured()) and SEARCH_BACKEND:
+        params = {'limit': per_page, 'offset': (page - 1) * per_page}
+        where = []
+        if SEARCH_BACKEND == 'fts5':
+            source = 'plan_entries p'
+            score = '0'
+            if terms:
+                source = 'plan_entries_fts JOIN plan_entries p ON p.id = plan_entries_fts.rowid'
+                score = 'bm25(plan_entries_fts)'  # kleiner ist besser
+                where.append('plan_entries_fts MATCH :q')
+                params['q'] = ' '.join(f'"{t}"*' for t in terms)
+            score_order = f'{score} ASC'
+        else:
+            source = 'plan_entries p'
+            score = '0'
+            if terms:
+                source = "plan_entries p, to_tsquery('simple', :q) query"
+                score = 'ts_rank(p.search_vector, query)'
+                where.append('p.search_vector @@ query')
+                params['q'] = ' & '.join(f'{t}:*' for t in terms)
+            score_order = f'{score} DESC'
+        if year:
+            where.append('p.datum LIKE :year')
+            params['year'] = f'%.{year}'
+        where_sql = ' AND '.join(where) or '1=1'
+        order = f'{_DATE_SORT_SQL} DESC, p.id DESC' if sort == 'datum' or not terms else f'{score_order}, p.id DESC'
+        db = SessionLocal()
+        try:
+            total = db.execute(sql_text(f'SELECT count(*) FROM {source} WHERE {where_sql}'), params).scalar() or 0
+            rows = db.execute(sql_text(
+                f'SELECT p.datum, p.messdiener_text, p.art_uhrzeit, {score} AS score FROM {source} '
+                f'WHERE {where_sql} ORDER BY {order} LIMIT :limit OFFSET :offset'), params).all()
+            result['results'] = [
+                {'datum': r[0] or '', 'messdiener': r[1] or '', 'art_uhrzeit': r[2] or '', 'score': float(r[3] or 0)}
+                for r in rows
+            ]
+            result['total'] = total
+        except Exception as e:
+            logger.error(f"DB-Fehler in search_plan(): {e}")
+            rows = None
+        finally:
+            db.close()
+
+    if rows is None:
+        matches = _search_plan_fallback(terms, year, sort)
+        result['total'] = len(matches)
+        result['results'] = matches[(page - 1) * per_page:page * per_page]
+    result['pages'] = math.ceil(result['total'] / per_page)
+    return result
+
+
+@app.route('/admin/search')
+def admin_search():
+    if not session.get('admin'):
+        if request.args.get('format') == 'json':
+            return jsonify({'error': 'Nicht angemeldet.'}), 401
+        flash('Sie müssen sich als Administrator anmelden!', 'error')
+        return redirect(url_for('login'))
+
+    query = request.args.get('q', '').strip()
+    year = request.args.get('jahr', '').strip()
+    year = year if re.fullmatch(r'\d{4}', year) else None
+    sort = 'datum' if request.args.get('sort') == 'datum' else 'relevanz'
+    try:
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        page = 1
+    result = search_plan(query, year=year, sort=sort, page=page)
+    if request.args.get('format') == 'json':
+        return jsonify(result)
+    return render_template('search.html', q=query, jahr=year or '', sort=sort, **result)
+
+
 @app.route('/logout')
 def logout():
     session.pop('admin', None)
@@ -798,6 +2667,10 @@ def debug_env():
     else:
         return "Debug-Info nur in Entwicklung verfügbar", 403
 
+# Erst hier starten: der Abgleich nutzt Funktionen, die weiter oben definiert werden
+if gist_configured():
+    threading.Thread(target=_gist_reconcile_loop, name='gist-reconcile', daemon=True).start()
+
 if __name__ == '__main__':
     try:
         port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,98 @@
+"""Lasttest für das Eintragen in Warteschlangen mit begrenzter Kapazität.
+
+Startet viele gleichzeitige Eintragungen gegen eine frische Datenbank und prüft danach,
+dass keine Queue überbucht ist und niemand in mehr als 2 Warteschlangen steht.
+
+    python bench_enroll.py [--threads 16] [--people 400] [--capacity 25] [--database-url URL]
+
+Ohne --database-url wird eine temporäre SQLite-Datei verwendet.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--people', type=int, default=400)
+    parser.add_argument('--queues', type=int, default=4)
+    parser.add_argument('--capacity', type=int, default=25)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    # app.py legt data/ relativ zum Arbeitsverzeichnis an -> in ein Temp-Verzeichnis wechseln
+    workdir = tempfile.mkdtemp(prefix='bench-enroll-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('STATIC_EXPORT_DIR', '')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import app as messdiener
+
+    for i in range(args.queues):
+        messdiener.storage_admin_add_queue(f'Bench {i + 1}', args.capacity)
+    queues, _, _ = messdiener.storage_get_queues_and_enrollments()
+    queue_ids = [row[0] for row in queues[1:]]
+
+    # Jede Person versucht sich in 3 Queues einzutragen (nur 2 sind erlaubt)
+    # Jede zweite Person mit Umlaut am Anfang: das Limit muss auch für Nicht-ASCII-Namen greifen
+    names = [f'Özlem {p}' if p % 2 else f'Person {p}' for p in range(args.people)]
+    jobs = [(names[p], queue_ids[(p + k) % len(queue_ids)]) for p in range(args.people) for k in range(3)]
+    latencies, results = [], {'ok': 0, 'waitlist': 0, 'rejected': 0, 'error': 0}
+    lock = threading.Lock()
+    cursor = iter(jobs)
+
+    def worker():
+        while True:
+            with lock:
+                job = next(cursor, None)
+            if job is None:
+                return
+            started = time.perf_counter()
+            try:
+                ok, msg = messdiener.storage_enroll_person(*job)
+                key = ('waitlist' if 'Warteliste' in msg else 'ok') if ok else 'rejected'
+            except Exception:
+                key = 'error'
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                results[key] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Backend:     {messdiener.engine.dialect.name}, {args.threads} Threads")
+    print(f"Anfragen:    {len(jobs)} in {duration:.2f}s ({len(jobs) / duration:.0f}/s)")
+    print(f"Ergebnis:    {results}")
+    print(f"Latenz p50:  {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"Latenz p95:  {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+
+    # Invarianten prüfen
+    _, enroll_by_queue, waitlist_by_queue = messdiener.storage_get_queues_and_enrollments()
+    per_person = {}
+    for qid in queue_ids:
+        active = enroll_by_queue.get(qid, [])
+        waiting = waitlist_by_queue.get(qid, [])
+        assert len(active) <= args.capacity, f'Queue {qid} überbucht: {len(active)} > {args.capacity}'
+        assert not waiting or len(active) == args.capacity, f'Queue {qid} hat Warteliste trotz freier Plätze'
+        for person in active + waiting:
+            per_person[person] = per_person.get(person, 0) + 1
+    assert max(per_person.values()) <= 2, 'Person in mehr als 2 Warteschlangen'
+    assert results['rejected'] == args.people, 'Dritte Eintragung nicht für jede Person abgelehnt'
+    assert results['error'] == 0, 'Fehler beim Eintragen'
+    print('Invarianten: ok')
+
+
+if __name__ == '__main__':
+    main()
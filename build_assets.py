@@ -0,0 +1,66 @@
+"""Erzeugt vorkomprimierte Varianten (.gz, .br) der statischen Assets.
+
+Aufruf (z.B. im Build-Schritt des Deployments):
+    python build_assets.py
+
+Brotli-Dateien werden nur erzeugt, wenn das Paket ``Brotli`` installiert ist.
+"""
+import gzip
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+# Schriften (woff/woff2) und Bilder sind bereits komprimiert
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+MIN_SIZE = 512
+
+
+def _up_to_date(source, target):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def _write(target, data):
+    tmp = target + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, target)
+
+
+def build(static_dir=STATIC_DIR):
+    written = 0
+    for root, _dirs, files in os.walk(static_dir):
+        for fn in files:
+            if not fn.endswith(COMPRESSIBLE):
+                continue
+            source = os.path.join(root, fn)
+            if os.path.getsize(source) < MIN_SIZE:
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            if not _up_to_date(source, source + '.gz'):
+                _write(source + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                written += 1
+            if brotli is not None and not _up_to_date(source, source + '.br'):
+                _write(source + '.br', brotli.compress(data, quality=11))
+                written += 1
+    return written
+
+
+def main():
+    try:
+        written = build()
+    except Exception as e:
+        sys.stderr.write(f"Asset-Build fehlgeschlagen: {e}\n")
+        sys.exit(1)
+    if brotli is None:
+        sys.stderr.write("Hinweis: Brotli nicht installiert – nur .gz-Dateien erzeugt.\n")
+    print(f"{written} vorkomprimierte Dateien geschrieben.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import os
 import sys
 import json
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, Boolean
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
 # Build DATABASE_URL similar to app.py logic
@@ -32,6 +32,7 @@ class Queue(Base):
     __tablename__ = 'queues'
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
+    capacity = Column(Integer, nullable=True)
 
 class Enrollment(Base):
     __tablename__ = 'enrollments'
@@ -39,6 +40,7 @@ class Enrollment(Base):
     person = Column(String(100), nullable=False)
     queue_id = Column(Integer, ForeignKey('queues.id', ondelete='CASCADE'), nullable=False)
     timestamp = Column(String(32), nullable=True)
+    waitlisted = Column(Boolean, nullable=False, default=False)
 
     queue = relationship('Queue')
 
@@ -53,13 +55,13 @@ def main():
             for e in db.query(PlanEntry).order_by(PlanEntry.id.asc()).all():
                 plan.append([e.datum or "", e.messdiener_text or "", e.art_uhrzeit or ""]) 
 
-            queues = [["ID", "Name"]]
+            queues = [["ID", "Name", "Kapazität"]]
             for q in db.query(Queue).order_by(Queue.id.asc()).all():
-                queues.append([str(q.id), q.name])
+                queues.append([str(q.id), q.name, "" if q.capacity is None else str(q.capacity)])
 
-            enrollments = [["Person", "QueueID", "Timestamp"]]
+            enrollments = [["Person", "QueueID", "Timestamp", "Warteliste"]]
             for en in db.query(Enrollment).order_by(Enrollment.id.asc()).all():
-                enrollments.append([en.person, str(en.queue_id), en.timestamp or ""]) 
+                enrollments.append([en.person, str(en.queue_id), en.timestamp or "", "W" if en.waitlisted else ""])
 
             state = {"plan": plan, "queues": queues, "enrollments": enrollments}
             json.dump(state, sys.stdout, ensure_ascii=False, indent=2)
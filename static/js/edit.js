@@ -0,0 +1,96 @@
+// Hilfsfunktionen für bessere Benutzerfreundlichkeit
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('editForm');
+    const tbody = document.querySelector('#planTable tbody');
+    const rowCountInput = document.getElementById('rowCount');
+    const dirtyRows = new Set();
+    let formChanged = false;
+
+    // Hilfsfunktionen für Textareas: Auto-resize und Komma-Trennung
+    function enhanceTextarea(textarea) {
+        textarea.addEventListener('input', function() {
+            this.style.height = 'auto';
+            this.style.height = this.scrollHeight + 'px';
+        });
+
+        textarea.addEventListener('blur', function() {
+            let value = this.value.trim();
+            if (value && !value.includes(',') && value.split(' ').length > 1) {
+                // Automatisch Kommas zwischen Namen einfügen wenn Leerzeichen vorhanden
+                this.value = value.replace(/\s+/g, ', ');
+                dirtyRows.add(this.closest('tr').dataset.row);
+            }
+        });
+    }
+    form.querySelectorAll('textarea').forEach(enhanceTextarea);
+
+    // Geänderte Zeilen merken – beim Speichern werden nur diese übertragen
+    form.addEventListener('input', function(e) {
+        const tr = e.target.closest('tr[data-row]');
+        if (tr) dirtyRows.add(tr.dataset.row);
+    });
+
+    // Neue Zeile direkt im Browser anlegen (ohne den ganzen Plan zu senden)
+    document.getElementById('addRowBtn').addEventListener('click', function(e) {
+        // Keine Zeile als Vorlage (leerer Plan): klassischer Submit legt die Zeile serverseitig an
+        const last = tbody && tbody.querySelector('tr[data-row]:last-child');
+        if (!last) return;
+        e.preventDefault();
+        const index = tbody.querySelectorAll('tr[data-row]').length + 1;
+        const tr = last.cloneNode(true);
+        tr.dataset.row = index;
+        tr.querySelectorAll('input, textarea').forEach(function(field) {
+            field.name = field.name.replace(/_\d+$/, '_' + index);
+            field.value = '';
+            field.style.height = '';
+        });
+        tbody.appendChild(tr);
+        tr.querySelectorAll('textarea').forEach(enhanceTextarea);
+        dirtyRows.add(String(index));
+        tr.querySelector('input').focus();
+    });
+
+    // Speichern als JSON-Teil-Update; ohne JavaScript greift der normale Formular-Submit
+    document.getElementById('savePlanBtn').addEventListener('click', function(e) {
+        if (!tbody) return;
+        e.preventDefault();
+        const rows = Array.from(dirtyRows).map(function(index) {
+            const tr = tbody.querySelector('tr[data-row="' + index + '"]');
+            return {
+                index: parseInt(index, 10),
+                datum: tr.querySelector('[name^="datum_"]').value,
+                messdiener: tr.querySelector('[name^="messdiener_"]').value,
+                art_zeit: tr.querySelector('[name^="art_zeit_"]').value
+            };
+        });
+        fetch(form.dataset.batchUrl, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({row_count: parseInt(rowCountInput.value, 10), rows: rows})
+        }).then(function(response) {
+            return response.json().then(function(data) { return {status: response.status, data: data}; });
+        }).then(function(result) {
+            if (result.data.ok) {
+                formChanged = false;
+                window.location = form.dataset.indexUrl;
+            } else {
+                alert(result.data.error || (result.data.errors || []).join('\n'));
+            }
+        }).catch(function() {
+            alert('Speichern fehlgeschlagen. Bitte erneut versuchen.');
+        });
+    });
+
+    // Bestätigung vor dem Verlassen bei ungespeicherten Änderungen
+    form.addEventListener('input', () => formChanged = true);
+
+    window.addEventListener('beforeunload', function(e) {
+        if (formChanged) {
+            e.preventDefault();
+            e.returnValue = '';
+        }
+    });
+
+    // Reset flag when saving
+    form.addEventListener('submit', () => formChanged = false);
+});